@@ -0,0 +1,200 @@
+"""Local stand-in of the Aigues de Barcelona API.
+
+Serves the ``ofex-*`` endpoints used by the integration with
+deterministic, realistic payloads: every contract has a daily usage
+profile, readings are published ``lag`` after they happen, and each
+response can be delayed to mimic the real service.
+"""
+
+import asyncio
+import base64
+import json
+import time
+from datetime import datetime
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
+from aiohttp import web
+
+TZ = ZoneInfo("Europe/Madrid")
+
+# share of the daily consumption used at each hour, adds up to 1
+PROFILE = [
+    0.005, 0.003, 0.002, 0.002, 0.002, 0.005, 0.03, 0.09,
+    0.08, 0.05, 0.04, 0.04, 0.05, 0.06, 0.05, 0.04,
+    0.04, 0.05, 0.06, 0.08, 0.09, 0.07, 0.04, 0.025,
+]  # fmt: skip
+PROFILE_SUM = [sum(PROFILE[:hour]) for hour in range(25)]
+
+# readings before this date are not available
+ORIGIN = datetime(2015, 1, 1, tzinfo=TZ)
+
+
+def make_token(user: str = "12345678Z", ttl: int = 3600) -> str:
+    """Return a JWT shaped token accepted by ``TokenManager``."""
+
+    def encode(data: dict) -> str:
+        raw = json.dumps(data).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    header = encode({"alg": "HS256", "typ": "JWT"})
+    claims = encode({"name": user, "exp": int(time.time()) + ttl})
+    return f"{header}.{claims}.signature"
+
+
+class FakeAiguesApi:
+    """aiohttp application answering as the Aigues de Barcelona API."""
+
+    def __init__(
+        self,
+        contracts: list[str] = ("1234567",),
+        latency: float = 0.0,
+        lag: timedelta = timedelta(hours=8),
+        daily_usage: float = 0.3,
+        now=None,
+    ) -> None:
+        self.contracts = list(contracts)
+        self.latency = latency
+        self.lag = lag
+        # m3 per day of the first contract, the others use a bit more
+        self.daily_usage = daily_usage
+        # callable returning the current time, to drive a faked clock
+        self.now = now or (lambda: datetime.now(TZ))
+        self.requests = 0
+        self.bytes = 0
+        self.by_path: dict[str, int] = dict()
+        self.url = None
+        self._runner = None
+
+        self.app = web.Application(middlewares=[self._middleware])
+        self.app.router.add_post("/ofex-login-api/auth/getToken", self._get_token)
+        self.app.router.add_post("/ofex-login-api/auth/getProfile", self._get_profile)
+        self.app.router.add_get("/ofex-contracts-api/contracts", self._get_contracts)
+        self.app.router.add_get("/ofex-invoices-api/invoices", self._get_invoices)
+        self.app.router.add_get(
+            "/ofex-water-consumptions-api/meter/consumptions", self._get_consumptions
+        )
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving, return the base URL."""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset_stats(self) -> None:
+        self.requests = 0
+        self.bytes = 0
+        self.by_path.clear()
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response = await handler(request)
+        self.requests += 1
+        self.bytes += len(response.body or b"")
+        self.by_path[request.path] = self.by_path.get(request.path, 0) + 1
+        return response
+
+    def accumulated(self, contract: str, when: datetime) -> float:
+        """Return the meter reading at the end of the hour ``when``."""
+        usage = self.daily_usage * (1 + self.contracts.index(contract) * 0.1)
+        local = when.astimezone(TZ)
+        days = (local.date() - ORIGIN.date()).days
+        return round(1000 + usage * (days + PROFILE_SUM[local.hour + 1]), 4)
+
+    def readings(self, contract, date_from, date_to, frequency):
+        """Yield the readings between two dates, both included."""
+        last = self.now().astimezone(TZ) - self.lag
+        day = date_from
+        while day <= date_to:
+            start = datetime.combine(day, datetime.min.time(), tzinfo=TZ)
+            if frequency == "DAILY":
+                hours = [start + timedelta(hours=23)]
+            else:
+                hours = [start + timedelta(hours=hour) for hour in range(24)]
+            for when in hours:
+                if when > last:
+                    return
+                value = self.accumulated(contract, when)
+                yield {
+                    "datetime": (start if frequency == "DAILY" else when).isoformat(),
+                    "accumulatedConsumption": value,
+                    "deltaConsumption": round(
+                        value - self.accumulated(contract, when - timedelta(hours=1)),
+                        4,
+                    ),
+                    "meterNumber": f"M{contract}",
+                    "consumptionType": "REAL",
+                    "consumptionFrequency": frequency,
+                }
+            day += timedelta(days=1)
+
+    async def _get_token(self, request):
+        data = await request.json()
+        return web.json_response(
+            {"access_token": make_token(data.get("userIdentification"))}
+        )
+
+    async def _get_profile(self, request):
+        return web.json_response(
+            {"user_data": {"userId": request.query.get("userId"), "lang": "ca"}}
+        )
+
+    async def _get_contracts(self, request):
+        return web.json_response(
+            {
+                "data": [
+                    {
+                        "contractDetail": {
+                            "contractNumber": contract,
+                            "assignationStatus": "ASSIGNED",
+                            "supplyAddress": "C/ Fake 123, Barcelona",
+                        }
+                    }
+                    for contract in self.contracts
+                ]
+            }
+        )
+
+    async def _get_invoices(self, request):
+        contract = request.query.get("contractNumber")
+        months = int(request.query.get("lastMonths", 36))
+        if request.query.get("mode") == "DEBT":
+            # one unpaid invoice
+            months = 1
+        today = self.now().astimezone(TZ).date().replace(day=1)
+        invoices = list()
+        for month in range(0, months, 2):
+            issued = (today - timedelta(days=30 * month)).replace(day=1)
+            invoices.append(
+                {
+                    "invoiceNumber": f"{contract}-{issued:%Y%m}",
+                    "contractNumber": contract,
+                    "issueDate": issued.isoformat(),
+                    "periodFrom": (issued - timedelta(days=60)).isoformat(),
+                    "periodTo": (issued - timedelta(days=1)).isoformat(),
+                    "amount": round(40 + month % 5, 2),
+                    "status": "DEBT" if request.query.get("mode") == "DEBT" else "PAID",
+                }
+            )
+        return web.json_response({"data": invoices})
+
+    async def _get_consumptions(self, request):
+        contract = request.query.get("contractNumber")
+        if contract not in self.contracts:
+            return web.json_response({"errorMessage": "Unknown contract"}, status=404)
+        date_from = datetime.strptime(request.query["fromDate"], "%d-%m-%Y").date()
+        date_to = datetime.strptime(request.query["toDate"], "%d-%m-%Y").date()
+        frequency = request.query.get("consumptionFrequency", "HOURLY")
+        data = list(self.readings(contract, date_from, date_to, frequency))
+        return web.json_response({"data": data})
@@ -0,0 +1,57 @@
+"""Minimal Home Assistant instance to run the integration from scripts."""
+
+import contextlib
+import tempfile
+
+from homeassistant import config_entries
+from homeassistant import core
+from homeassistant import loader
+from homeassistant.bootstrap import async_load_base_functionality
+from homeassistant.components.recorder import get_instance
+from homeassistant.components.recorder.db_schema import Statistics
+from homeassistant.components.recorder.db_schema import StatisticsMeta
+from homeassistant.components.recorder.util import session_scope
+from homeassistant.helpers import recorder as recorder_helper
+from homeassistant.setup import async_setup_component
+
+from custom_components.aigues_barcelona.const import DOMAIN
+
+
+@contextlib.asynccontextmanager
+async def async_test_home_assistant(time_zone: str = "Europe/Madrid"):
+    """Start Home Assistant with a SQLite recorder in a temporary folder."""
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = core.HomeAssistant(config_dir)
+        hass.config_entries = config_entries.ConfigEntries(hass, {})
+        loader.async_setup(hass)
+        await async_load_base_functionality(hass)
+        hass.config.set_time_zone(time_zone)
+
+        recorder_helper.async_initialize_recorder(hass)
+        db_url = f"sqlite:///{config_dir}/home-assistant_v2.db"
+        assert await async_setup_component(
+            hass, "recorder", {"recorder": {"db_url": db_url, "commit_interval": 0}}
+        )
+        await hass.async_start()
+        hass.data.setdefault(DOMAIN, {})
+        try:
+            yield hass
+        finally:
+            await hass.async_stop(force=True)
+
+
+async def async_count_statistics(hass, statistic_id: str) -> int:
+    """Return how many statistics rows are stored for ``statistic_id``."""
+    instance = get_instance(hass)
+    await instance.async_block_till_done()
+
+    def _count():
+        with session_scope(hass=hass, read_only=True) as session:
+            return (
+                session.query(Statistics)
+                .join(StatisticsMeta, Statistics.metadata_id == StatisticsMeta.id)
+                .filter(StatisticsMeta.statistic_id == statistic_id)
+                .count()
+            )
+
+    return await instance.async_add_executor_job(_count)
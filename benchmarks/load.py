@@ -0,0 +1,266 @@
+"""Load test many accounts and contracts against the fake API.
+
+Run from the repository root:
+
+    python -m benchmarks.load --entries 1,10,50 --contracts 4 --cycles 12
+
+For every size, a fresh Home Assistant is started with ``entries``
+synthetic config entries of ``contracts`` contracts each. The fake API
+clock starts ``cycles * step`` in the past and moves ``step`` forward on
+every poll cycle, so each cycle publishes new readings. All the account
+coordinators refresh at once, the worst case of the scheduler.
+
+While the cycles run, a monitor samples the event loop lag, the default
+executor queue, the recorder backlog and the process memory. The run
+stops at the first size where a cycle fails or takes longer than
+``--max-cycle`` seconds.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timedelta
+
+from homeassistant.components.recorder import get_instance
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.config_entries import SOURCE_USER
+from homeassistant.const import CONF_PASSWORD
+from homeassistant.const import CONF_TOKEN
+from homeassistant.const import CONF_USERNAME
+
+from custom_components.aigues_barcelona.api import get_response_cache
+from custom_components.aigues_barcelona.const import CONF_CONTRACT
+from custom_components.aigues_barcelona.const import DOMAIN
+from custom_components.aigues_barcelona.coordinator import AiguesAccountCoordinator
+
+from .fake_api import FakeAiguesApi
+from .fake_api import make_token
+from .fake_api import TZ
+from .hass import async_test_home_assistant
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# same default executor size as Home Assistant
+MAX_EXECUTOR_WORKERS = 64
+
+
+def rss() -> int:
+    """Return the memory used by the process in bytes."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    # peak only, in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class FakeClock:
+    """Time seen by the fake API, moved forward by the harness."""
+
+    def __init__(self, start: datetime) -> None:
+        self.time = start
+
+    def __call__(self) -> datetime:
+        return self.time
+
+    def advance(self, step: timedelta) -> None:
+        self.time += step
+
+
+class Monitor:
+    """Sample the event loop health while the cycles run."""
+
+    def __init__(self, hass, executor: ThreadPoolExecutor, interval: float) -> None:
+        self.hass = hass
+        self.executor = executor
+        self.interval = interval
+        self._task = None
+        self.reset()
+
+    def reset(self) -> None:
+        self.lags = list()
+        self.executor_queue = list()
+        self.recorder_backlog = list()
+        self.memory = list()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        recorder = get_instance(self.hass)
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(loop.time() - expected, 0.0))
+            self.executor_queue.append(self.executor._work_queue.qsize())
+            self.recorder_backlog.append(recorder.backlog)
+            self.memory.append(rss())
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def summary(self) -> dict:
+        lags = sorted(self.lags) or [0.0]
+        return {
+            "loop_lag_mean": round(statistics.fmean(lags), 4),
+            "loop_lag_p95": round(lags[int(len(lags) * 0.95)], 4),
+            "loop_lag_max": round(lags[-1], 4),
+            "executor_queue_max": max(self.executor_queue, default=0),
+            "recorder_backlog_max": max(self.recorder_backlog, default=0),
+            "memory_max": max(self.memory, default=rss()),
+        }
+
+
+def create_entries(entries: int, contracts: int) -> list[ConfigEntry]:
+    return [
+        ConfigEntry(
+            version=1,
+            minor_version=1,
+            domain=DOMAIN,
+            title=f"Account {entry}",
+            data={
+                CONF_USERNAME: f"{entry:08d}Z",
+                CONF_PASSWORD: "password",
+                CONF_TOKEN: make_token(f"{entry:08d}Z"),
+                CONF_CONTRACT: [
+                    f"{entry:05d}{contract:03d}" for contract in range(contracts)
+                ],
+            },
+            source=SOURCE_USER,
+        )
+        for entry in range(entries)
+    ]
+
+
+async def async_run_size(args, entries: int) -> dict:
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=MAX_EXECUTOR_WORKERS)
+    loop.set_default_executor(executor)
+    get_response_cache().clear()
+
+    step = timedelta(minutes=args.step)
+    clock = FakeClock(datetime.now(TZ) - step * args.cycles)
+    config_entries = create_entries(entries, args.contracts)
+    server = FakeAiguesApi(
+        contracts=[c for e in config_entries for c in e.data[CONF_CONTRACT]],
+        latency=args.latency,
+        now=clock,
+    )
+    await server.start()
+
+    size = {"entries": entries, "contracts": entries * args.contracts, "cycles": []}
+    try:
+        async with async_test_home_assistant() as hass:
+            coordinators = list()
+            for entry in config_entries:
+                coordinator = AiguesAccountCoordinator(hass, entry)
+                coordinator.api.api_host = server.url
+                coordinators.append(coordinator)
+
+            monitor = Monitor(hass, executor, args.interval)
+            monitor.start()
+            for cycle in range(args.cycles):
+                clock.advance(step)
+                server.reset_stats()
+                monitor.reset()
+                started = time.perf_counter()
+                await asyncio.gather(*[c.async_refresh() for c in coordinators])
+                await get_instance(hass).async_block_till_done()
+                result = {
+                    "cycle": cycle,
+                    "duration": round(time.perf_counter() - started, 3),
+                    "requests": server.requests,
+                    "failed": sum(not c.last_update_success for c in coordinators),
+                    **monitor.summary(),
+                }
+                size["cycles"].append(result)
+                print(format_cycle(entries, result))
+                if result["failed"] or result["duration"] > args.max_cycle:
+                    break
+            await monitor.stop()
+    finally:
+        await server.stop()
+        executor.shutdown(wait=False)
+    return size
+
+
+def format_cycle(entries: int, result: dict) -> str:
+    return (
+        f"{entries:4} entries  cycle {result['cycle']:3}  "
+        f"{result['duration']:7.2f}s  {result['requests']:5} req  "
+        f"{result['failed']:3} failed  "
+        f"lag p95 {result['loop_lag_p95'] * 1000:6.1f}ms "
+        f"max {result['loop_lag_max'] * 1000:6.1f}ms  "
+        f"executor {result['executor_queue_max']:4}  "
+        f"recorder {result['recorder_backlog_max']:5}  "
+        f"{result['memory_max'] / 2**20:7.1f} MiB"
+    )
+
+
+async def async_run(args) -> list[dict]:
+    sizes = list()
+    for entries in args.entries:
+        size = await async_run_size(args, entries)
+        sizes.append(size)
+        last = size["cycles"][-1] if size["cycles"] else None
+        if last is None or last["failed"] or last["duration"] > args.max_cycle:
+            print(f"Breaking point reached at {entries} entries")
+            break
+    return sizes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--entries",
+        type=lambda value: [int(x) for x in value.split(",")],
+        default=[1, 10, 50, 100],
+        help="comma separated config entry counts to try, in order",
+    )
+    parser.add_argument("--contracts", type=int, default=2, help="per entry")
+    parser.add_argument("--cycles", type=int, default=6)
+    parser.add_argument(
+        "--step", type=int, default=60, help="fake clock minutes per cycle"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds added to each response"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.05, help="monitor sampling, seconds"
+    )
+    parser.add_argument(
+        "--max-cycle", type=float, default=60.0, help="slowest acceptable cycle"
+    )
+    parser.add_argument("--output", help="where to save the results")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    sizes = asyncio.run(async_run(args))
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"load-{args.contracts}-contracts.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fp:
+        json.dump({"args": vars(args), "sizes": sizes}, fp, indent=2)
+        fp.write("\n")
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Benchmark the integration against a local stand-in of the API.
+
+Run from the repository root:
+
+    python -m benchmarks.run --latency 0.05
+    python -m benchmarks.run --compare benchmarks/results/0.4.7.json
+
+Every scenario reports wall time, requests, bytes received, peak
+memory and rows written. Peak memory is measured with ``tracemalloc``
+(client and fake server together) in a second run of the scenario, as
+tracing slows everything down. Results are saved as JSON, one file per
+integration version.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+from datetime import timedelta
+
+from custom_components.aigues_barcelona.api import AiguesApiClient
+from custom_components.aigues_barcelona.api import AsyncAiguesApiClient
+from custom_components.aigues_barcelona.api import create_session
+from custom_components.aigues_barcelona.api import get_response_cache
+from custom_components.aigues_barcelona.backfill import async_fetch_windows
+from custom_components.aigues_barcelona.backfill import plan_windows
+from custom_components.aigues_barcelona.coordinator import ContratoAgua
+from custom_components.aigues_barcelona.importer import StatisticsImporter
+from custom_components.aigues_barcelona.series import ConsumptionSeries
+from custom_components.aigues_barcelona.series import to_hour
+from custom_components.aigues_barcelona.version import VERSION
+
+from .fake_api import FakeAiguesApi
+from .fake_api import make_token
+from .hass import async_count_statistics
+from .hass import async_test_home_assistant
+
+USERNAME = "12345678Z"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+METRICS = ("wall_time", "requests", "bytes", "peak_memory", "rows")
+
+SCENARIOS = dict()
+
+
+def scenario(func):
+    SCENARIOS[func.__name__] = func
+    return func
+
+
+class Context:
+    """What a scenario needs: the fake API, a session and Home Assistant."""
+
+    def __init__(self, server: FakeAiguesApi, session, hass) -> None:
+        self.server = server
+        self.session = session
+        self.hass = hass
+
+    def contract(self) -> str:
+        """Return a contract never used before, so no state is shared."""
+        contract = f"{len(self.server.contracts) + 1000000}"
+        self.server.contracts.append(contract)
+        return contract
+
+    def async_client(self, contract=None) -> AsyncAiguesApiClient:
+        client = AsyncAiguesApiClient(
+            USERNAME, "password", contract, session=self.session
+        )
+        client.api_host = self.server.url
+        client.set_token(make_token(USERNAME))
+        return client
+
+
+@scenario
+async def sync_poll(ctx: Context) -> int:
+    """A week of hourly readings with the blocking client."""
+    contract = ctx.contract()
+    client = AiguesApiClient(USERNAME, "password", contract)
+    client.api_host = ctx.server.url
+    client.set_token(make_token(USERNAME))
+    today = datetime.now()
+
+    rows = await asyncio.get_running_loop().run_in_executor(
+        None, client.consumptions, today - timedelta(days=7), today
+    )
+    client.cli.close()
+    return len(rows)
+
+
+@scenario
+async def async_poll(ctx: Context) -> int:
+    """A week of hourly readings with the async client."""
+    client = ctx.async_client(ctx.contract())
+    today = datetime.now()
+    rows = await client.consumptions(today - timedelta(days=7), today)
+    return len(rows)
+
+
+@scenario
+async def async_backfill(ctx: Context) -> int:
+    """A year of daily readings, in windows fetched concurrently."""
+    client = ctx.async_client(ctx.contract())
+    today = datetime.now()
+
+    async def fetch(date_from, date_to):
+        return await client.consumptions(date_from, date_to, frequency="DAILY")
+
+    result = await async_fetch_windows(
+        fetch, plan_windows(today - timedelta(days=365), today)
+    )
+    return len(result.rows)
+
+
+@scenario
+async def statistics_import(ctx: Context) -> int:
+    """A year of hourly rows written to the recorder."""
+    statistic_id = f"sensor.contador_{ctx.contract()}"
+    start = to_hour(datetime.now() - timedelta(days=365))
+    hours = range(start, start + 24 * 365)
+    series = ConsumptionSeries(hours, [0.01 * (hour - start) for hour in hours])
+
+    importer = StatisticsImporter(ctx.hass, statistic_id)
+    importer.add(series)
+    await importer.async_flush()
+    return await async_count_statistics(ctx.hass, statistic_id)
+
+
+@scenario
+async def contract_poll(ctx: Context) -> int:
+    """First update of a contract: fetch, cache and import."""
+    contrato = ContratoAgua(ctx.hass, ctx.async_client(), ctx.contract())
+    await contrato.async_update()
+    return await async_count_statistics(ctx.hass, contrato.internal_sensor_id)
+
+
+@scenario
+async def contract_backfill(ctx: Context) -> int:
+    """A year of history of a contract: plan, fetch, cache and import."""
+    contrato = ContratoAgua(ctx.hass, ctx.async_client(), ctx.contract())
+    await contrato.import_old_consumptions(days=365)
+    return await async_count_statistics(ctx.hass, contrato.internal_sensor_id)
+
+
+async def async_run_scenario(name: str, ctx: Context, memory: bool = True) -> dict:
+    ctx.server.reset_stats()
+    get_response_cache().clear()
+    started = time.perf_counter()
+    rows = await SCENARIOS[name](ctx)
+    result = {
+        "wall_time": round(time.perf_counter() - started, 4),
+        "requests": ctx.server.requests,
+        "bytes": ctx.server.bytes,
+        "peak_memory": None,
+        "rows": rows,
+    }
+
+    if memory:
+        get_response_cache().clear()
+        tracemalloc.start()
+        try:
+            await SCENARIOS[name](ctx)
+            result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+async def async_run(names: list[str], latency: float, memory: bool = True) -> dict:
+    server = FakeAiguesApi(contracts=[], latency=latency)
+    await server.start()
+    session = create_session()
+    results = dict()
+    try:
+        async with async_test_home_assistant() as hass:
+            ctx = Context(server, session, hass)
+            for name in names:
+                results[name] = await async_run_scenario(name, ctx, memory)
+                print(format_result(name, results[name]))
+    finally:
+        await session.close()
+        await server.stop()
+    return results
+
+
+def format_result(name: str, result: dict, previous: dict = None) -> str:
+    peak = result["peak_memory"]
+    line = (
+        f"{name:20} {result['wall_time']:8.3f}s {result['requests']:5} req "
+        f"{result['bytes'] / 1024:9.1f} KiB "
+        f"{'-' if peak is None else f'{peak / 1024:.1f}':>9} KiB peak "
+        f"{result['rows']:6} rows"
+    )
+    if previous:
+        changes = list()
+        for metric in METRICS:
+            before, after = previous.get(metric), result[metric]
+            if before and after is not None and before != after:
+                changes.append(f"{metric} {(after - before) / before:+.0%}")
+        line += f"  ({', '.join(changes) or 'no change'})"
+    return line
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", choices=[[], *SCENARIOS])
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to each response"
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the peak memory run"
+    )
+    parser.add_argument("--output", help="where to save the results")
+    parser.add_argument("--compare", help="results of a previous run")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    results = asyncio.run(
+        async_run(args.scenarios or list(SCENARIOS), args.latency, not args.no_memory)
+    )
+
+    report = {
+        "version": VERSION,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "latency": args.latency,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{VERSION}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fp:
+        json.dump(report, fp, indent=2)
+        fp.write("\n")
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as fp:
+            previous = json.load(fp)
+        print(f"Compared with {previous['version']} ({previous['date']}):")
+        for name, result in results.items():
+            print(format_result(name, result, previous["results"].get(name)))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,62 +2,120 @@
 
 from __future__ import annotations
 
+import asyncio
+import logging
+import random
+
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.config_entries import SOURCE_REAUTH
-from homeassistant.const import CONF_PASSWORD
-from homeassistant.const import CONF_TOKEN
-from homeassistant.const import CONF_USERNAME
+from homeassistant.const import EVENT_HOMEASSISTANT_START
 from homeassistant.const import Platform
+from homeassistant.core import callback
+from homeassistant.core import CoreState
 from homeassistant.core import HomeAssistant
 from homeassistant.exceptions import ConfigEntryAuthFailed
+from homeassistant.helpers.event import async_track_point_in_utc_time
 
-from .api import AiguesApiClient
 from .const import DOMAIN
-from .const import CONF_COMPANY_IDENTIFICATOR
+from .const import FIRST_REFRESH_CONCURRENCY
+from .const import FIRST_REFRESH_JITTER
+from .const import TOKEN_EXPIRY_MARGIN
+from .coordinator import AiguesAccountCoordinator
 from .service import async_setup as setup_service
 
 # from homeassistant.exceptions import ConfigEntryNotReady
 
-PLATFORMS = [Platform.SENSOR]
+_LOGGER = logging.getLogger(__name__)
+
+PLATFORMS = [Platform.BINARY_SENSOR, Platform.SENSOR]
+
+DATA_REFRESH_SEMAPHORE = f"{DOMAIN}_refresh_semaphore"
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
 
+    hass.data.setdefault(DOMAIN, {})
+
     # TODO Change after fixing Recaptcha.
-    api = AiguesApiClient(
-        entry.data[CONF_USERNAME],
-        entry.data[CONF_PASSWORD],
-        company_identification=entry.data.get(CONF_COMPANY_IDENTIFICATOR),
-    )
-    api.set_token(entry.data.get(CONF_TOKEN))
+    coordinator = AiguesAccountCoordinator(hass, entry)
 
-    if api.is_token_expired():
-        await hass.config_entries.flow.async_init(
-            DOMAIN,
-            context={"source": SOURCE_REAUTH},
-            data=entry,
-        )
+    if coordinator.api.is_token_expired():
+        entry.async_start_reauth(hass)
         return False
         raise ConfigEntryAuthFailed
 
+    # ask for a new token before the current one expires
+    @callback
+    def async_token_expiring(now) -> None:
+        _LOGGER.warning(f"Token of {entry.title} is about to expire")
+        # does nothing if a reauth flow of the entry is already open
+        entry.async_start_reauth(hass)
+
+    expires_at = coordinator.api.token_manager.expires_at
+    entry.async_on_unload(
+        async_track_point_in_utc_time(
+            hass, async_token_expiring, expires_at - TOKEN_EXPIRY_MARGIN
+        )
+    )
+
     # try:
     #    await hass.async_add_executor_job(api.login)
     # except:
     #    raise ConfigEntryNotReady
 
+    hass.data[DOMAIN][entry.entry_id] = coordinator
+    # running totals are shown before the first refresh
+    await coordinator.async_load_state()
+
+    # entities start from the restored state, the first refresh runs in
+    # the background, spread in time and with few accounts at once
+    semaphore = hass.data.setdefault(
+        DATA_REFRESH_SEMAPHORE, asyncio.Semaphore(FIRST_REFRESH_CONCURRENCY)
+    )
+
+    async def async_first_refresh():
+        await asyncio.sleep(random.uniform(0, FIRST_REFRESH_JITTER))
+        async with semaphore:
+            # queued before the update, which may ask for a backfill too
+            coordinator.async_resume_backfills()
+            await coordinator.async_refresh()
+            await coordinator.invoices.async_refresh()
+
+    @callback
+    def async_schedule_first_refresh(*args):
+        entry.async_create_background_task(
+            hass, async_first_refresh(), f"{DOMAIN} first refresh {entry.title}"
+        )
+
+    if hass.state == CoreState.running:
+        async_schedule_first_refresh()
+    else:
+        hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_START, async_schedule_first_refresh
+        )
+
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
+
     await setup_service(hass, entry)
 
     return True
 
 
+async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload the entry when its options change."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
         if entry.entry_id in hass.data[DOMAIN].keys():
-            hass.data[DOMAIN].pop(entry.entry_id)
+            coordinator = hass.data[DOMAIN].pop(entry.entry_id)
+            for contract in coordinator.contracts:
+                hass.data[DOMAIN].pop(contract, None)
     if not hass.data[DOMAIN]:
         del hass.data[DOMAIN]
+        hass.data.pop(DATA_REFRESH_SEMAPHORE, None)
 
     return unload_ok
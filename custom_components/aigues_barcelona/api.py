@@ -1,12 +1,40 @@
+import asyncio
 import base64
+import contextlib
 import datetime
 import json
 import logging
+import random
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple
 
 import requests
 
+try:
+    import aiohttp
+except ImportError:  # sync client only, e.g. when used from scripts
+    aiohttp = None
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 from .const import API_COOKIE_TOKEN
 from .const import API_HOST
+from .const import CIRCUIT_FAILURE_THRESHOLD
+from .const import CIRCUIT_RESET_TIMEOUT
+from .const import DEFAULT_CONNECTION_KEEPALIVE
+from .const import DEFAULT_CONNECTION_LIMIT
+from .const import DEFAULT_CONNECTION_LIMIT_PER_HOST
+from .const import RESPONSE_CACHE_SIZE
+from .const import RESPONSE_CACHE_TTL
+from .const import RETRY_ATTEMPTS
+from .const import RETRY_BACKOFF_BASE
+from .const import RETRY_BACKOFF_MAX
+from .metrics import RequestMetrics
 from .version import VERSION
 
 TIMEOUT = 60
@@ -14,18 +42,337 @@ TIMEOUT = 60
 _LOGGER: logging.Logger = logging.getLogger(__name__)
 
 
-class AiguesApiClient:
+class ConsumptionRecord(NamedTuple):
+    """A consumption reading as returned by the API, already parsed."""
+
+    datetime: datetime.datetime
+    accumulated_consumption: float
+
+    @classmethod
+    def from_api(cls, data: dict) -> "ConsumptionRecord":
+        return cls(
+            datetime.datetime.fromisoformat(data["datetime"]),
+            float(data["accumulatedConsumption"]),
+        )
+
+    def as_api(self) -> dict:
+        """Return the record in the format sent by the API."""
+        return {
+            "datetime": self.datetime.isoformat(),
+            "accumulatedConsumption": self.accumulated_consumption,
+        }
+
+
+class AiguesApiError(Exception):
+    """Error returned by the API."""
+
+    status = None
+    # the request can be sent again later
+    retryable = False
+    # the API is failing, counts for the circuit breaker
+    server_side = False
+
+    def __init__(self, message: str, retry_after: float = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BadRequestError(AiguesApiError):
+    status = 400
+
+
+class DeniedError(AiguesApiError):
+    status = 401
+
+
+class NotFoundError(AiguesApiError):
+    status = 404
+
+
+class RateLimitedError(AiguesApiError):
+    status = 429
+    retryable = True
+
+
+class ServerError(AiguesApiError):
+    status = 500
+    retryable = True
+    server_side = True
+
+
+class ServiceUnavailableError(ServerError):
+    status = 503
+
+
+class RequestFailedError(AiguesApiError):
+    """The request did not get any response."""
+
+    retryable = True
+    server_side = True
+
+
+class CircuitOpenError(AiguesApiError):
+    """The API is failing, requests are not sent for a while."""
+
+
+class CircuitBreaker:
+    """Stop sending requests to a host after repeated failures.
+
+    After ``threshold`` consecutive failures the circuit opens and every
+    request fails fast. Once ``reset_timeout`` seconds have passed, one
+    request is let through while the others keep failing fast: success
+    closes the circuit again, failure opens it for another period. A
+    probe that never reports back is replaced after ``reset_timeout``.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+    ) -> None:
+        self.host = host
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        # start of the request let through while half open
+        self.probe_started = None
+        self.stats = {"failures": 0, "opened": 0, "rejected": 0}
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == "open"
+
+    def check(self) -> None:
+        """Raise if requests must not be sent now."""
+        if self.state == "closed":
+            return
+        now = time.monotonic()
+        if self.state == "open":
+            started = self.opened_at
+        else:
+            # half open, a probe is in flight
+            started = self.probe_started
+        if now - started < self.reset_timeout:
+            self.stats["rejected"] += 1
+            raise CircuitOpenError(f"Circuit open for {self.host}, API is failing")
+        self.state = "half_open"
+        self.probe_started = now
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.state = "closed"
+        self.probe_started = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.stats["failures"] += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                _LOGGER.warning(f"Too many failures, pausing requests to {self.host}")
+                self.stats["opened"] += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.probe_started = None
+
+    def as_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            **self.stats,
+        }
+
+
+_BREAKERS: dict[str, CircuitBreaker] = dict()
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """Return the circuit breaker shared by all clients of a host."""
+    if host not in _BREAKERS:
+        _BREAKERS[host] = CircuitBreaker(host)
+    return _BREAKERS[host]
+
+
+class ResponseCache:
+    """LRU cache of API responses with a TTL per endpoint.
+
+    Entries are keyed by method, URL (path and query) and token, so
+    different accounts never share them. Expired entries are kept to be
+    revalidated with ``If-None-Match`` / ``If-Modified-Since`` when the
+    server sent an ``ETag`` or ``Last-Modified`` header.
+    """
+
+    def __init__(
+        self, ttls: dict = RESPONSE_CACHE_TTL, max_size: int = RESPONSE_CACHE_SIZE
+    ) -> None:
+        self.ttls = ttls
+        self.max_size = max_size
+        self._entries: OrderedDict[tuple, dict] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "evictions": 0}
+
+    def ttl(self, path: str) -> int:
+        """Return how long responses of a path can be reused."""
+        path = "/" + path.lstrip("/")
+        for prefix, ttl in self.ttls.items():
+            if path.startswith(prefix):
+                return ttl
+        return 0
+
+    def get(self, key: tuple) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.monotonic() < entry["expires"]
+
+    def validators(self, entry: dict | None) -> dict:
+        """Return the headers to revalidate an expired entry."""
+        headers = dict()
+        if entry is None:
+            return headers
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def set(self, key: tuple, value, ttl: int, headers=None) -> None:
+        headers = headers or {}
+        self._entries[key] = {
+            "value": value,
+            "expires": time.monotonic() + ttl,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def refresh(self, key: tuple, ttl: int):
+        """Extend an entry after a ``304 Not Modified``, return its value."""
+        entry = self._entries[key]
+        entry["expires"] = time.monotonic() + ttl
+        self.stats["revalidated"] += 1
+        return entry["value"]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+_RESPONSE_CACHE = ResponseCache()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the response cache shared by all clients."""
+    return _RESPONSE_CACHE
+
+
+def parse_retry_after(value) -> float | None:
+    """Return the seconds to wait from a ``Retry-After`` header."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (when - now).total_seconds())
+
+
+def backoff_delay(attempt: int, retry_after: float = None) -> float:
+    """Return the jittered exponential delay before retrying."""
+    delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2**attempt)
+    delay = random.uniform(delay / 2, delay)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def create_session(
+    limit: int = DEFAULT_CONNECTION_LIMIT,
+    limit_per_host: int = DEFAULT_CONNECTION_LIMIT_PER_HOST,
+    keepalive_timeout: int = DEFAULT_CONNECTION_KEEPALIVE,
+):
+    """Create a keep-alive aiohttp session to be shared by several clients.
+
+    Cookies are not stored in the session, each client sends its own
+    token, so the same session can be used for different accounts.
+    """
+    if aiohttp is None:
+        raise RuntimeError("aiohttp is required for the async client")
+
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        keepalive_timeout=keepalive_timeout,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        cookie_jar=aiohttp.DummyCookieJar(),
+        timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+    )
+
+
+class TokenManager:
+    """Hold the JWT token and its claims, decoded once when set."""
+
+    def __init__(self) -> None:
+        self.token = None
+        self.claims = dict()
+
+    def set(self, token: str) -> None:
+        self.token = token
+        self.claims = dict()
+        if not token:
+            return
+
+        try:
+            data = token.split(".")[1]
+            # add padding to avoid failures
+            data = base64.urlsafe_b64decode(data + "==")
+            self.claims = json.loads(data)
+        except (IndexError, ValueError) as e:
+            _LOGGER.warning(f"Unable to decode token: {e}")
+
+    def get(self, key):
+        if not self.token:
+            return False
+        return self.claims.get(key)
+
+    @property
+    def expires_at(self) -> datetime.datetime | None:
+        expires = self.get("exp")
+        if not expires:
+            return None
+        return datetime.datetime.fromtimestamp(expires, tz=datetime.timezone.utc)
+
+    def is_expired(self) -> bool:
+        expires = self.expires_at
+        if not expires:
+            return True
+        return datetime.datetime.now(datetime.timezone.utc) >= expires
+
+
+class _AiguesApiBase:
+    """Request building and response handling shared by sync and async
+    clients."""
+
     def __init__(
         self,
         username,
         password,
         contract=None,
-        session: requests.Session = None,
         company_identification=None,
     ):
-        if session is None:
-            session = requests.Session()
-        self.cli = session
         self.api_host = f"https://{API_HOST}"
         # https://www.aiguesdebarcelona.cat/o/ofex-theme/js/chunk-vendors.e5935b72.js
         # https://www.aiguesdebarcelona.cat/o/ofex-theme/js/app.0499d168.js
@@ -39,6 +386,12 @@ class AiguesApiClient:
         self._password = password
         self._contract = contract
         self._company_identification = company_identification
+        self.token_manager = TokenManager()
+        self.breaker = get_breaker(API_HOST)
+        self.stats = {"requests": 0, "retries": 0, "errors": 0}
+        # per endpoint metrics, off unless enabled in the options
+        self.metrics = RequestMetrics()
+        self.response_cache = get_response_cache()
         self.last_response = None
 
     def _generate_url(self, path, query) -> str:
@@ -48,65 +401,97 @@ class AiguesApiClient:
         return f"{self.api_host}/{path.lstrip('/')}{query_proc}"
 
     def _return_token_field(self, key):
-        token = self.cli.cookies.get_dict().get(API_COOKIE_TOKEN)
-        if not token:
-            return False
+        return self.token_manager.get(key)
 
-        data = token.split(".")[1]
-        # add padding to avoid failures
-        data = base64.urlsafe_b64decode(data + "==")
+    def _process_response(self, status_code: int, body: bytes, headers=None):
+        """Decode the response body once, raise on error codes.
 
-        return json.loads(data).get(key)
-
-    def _query(self, path, query=None, json=None, headers=None, method="GET"):
-        if headers is None:
-            headers = dict()
-        headers = {**self.headers, **headers}
+        Returns the decoded JSON body, as ``resp.json()`` would.
+        """
+        _LOGGER.debug(f"Query done with code {status_code}")
 
+        data = msg = body
+        # Try to parse JSON response if possible, straight from the bytes
         try:
-            resp = self.cli.request(
-                method=method,
-                url=self._generate_url(path, query),
-                json=json,
-                headers=headers,
-                timeout=TIMEOUT,
+            if body:
+                data = msg = json_loads(body)
+                if isinstance(msg, list) and len(msg) == 1:
+                    msg = msg[0]
+        except ValueError:
+            if isinstance(body, bytes):
+                data = msg = body.decode(errors="replace")
+            _LOGGER.debug(f"Response is not JSON: {msg}")
+        self.last_response = msg
+
+        retry_after = parse_retry_after((headers or {}).get("Retry-After"))
+        if status_code == 503:
+            raise ServiceUnavailableError(
+                "Service temporarily unavailable", retry_after
             )
-            _LOGGER.debug(f"Query done with code {resp.status_code}")
+        if status_code == 500:
+            raise ServerError(f"Server error: {msg}", retry_after)
+        if status_code == 404:
+            raise NotFoundError(f"Not found: {msg}")
+        if status_code == 401:
+            raise DeniedError(f"Denied: {msg}")
+        if status_code == 400:
+            raise BadRequestError(f"Bad response: {msg}")
+        if status_code == 429:
+            raise RateLimitedError(f"Rate-Limited: {msg}", retry_after)
 
-            # Store raw response first
-            self.last_response = resp.text
+        return data
 
-            # Try to parse JSON response if possible
-            try:
-                if resp.text and len(resp.text) > 0:
-                    msg = resp.json()
-                    if isinstance(msg, list) and len(msg) == 1:
-                        msg = msg[0]
-                    self.last_response = msg
-            except json.JSONDecodeError:
-                msg = resp.text
-                _LOGGER.debug(f"Response is not JSON: {msg}")
-
-            if resp.status_code == 503:
-                raise Exception("Service temporarily unavailable")
-            if resp.status_code == 500:
-                raise Exception(f"Server error: {msg}")
-            if resp.status_code == 404:
-                raise Exception(f"Not found: {msg}")
-            if resp.status_code == 401:
-                raise Exception(f"Denied: {msg}")
-            if resp.status_code == 400:
-                raise Exception(f"Bad response: {msg}")
-            if resp.status_code == 429:
-                raise Exception(f"Rate-Limited: {msg}")
-
-            return resp
-
-        except requests.exceptions.RequestException as e:
-            _LOGGER.error(f"Request failed: {str(e)}")
-            raise Exception(f"Request failed: {str(e)}")
+    def _cache_lookup(self, method: str, url: str):
+        """Return the cache key, TTL and entry of a request.
+
+        The key is None when the endpoint is not cached.
+        """
+        ttl = self.response_cache.ttl(url[len(self.api_host) :].split("?")[0])
+        if not ttl:
+            return None, 0, None
+        key = (method, url, self.token_manager.token)
+        entry = self.response_cache.get(key)
+        if entry is not None and self.response_cache.is_fresh(entry):
+            self.response_cache.stats["hits"] += 1
+        else:
+            self.response_cache.stats["misses"] += 1
+        return key, ttl, entry
+
+    def _record(self, path: str, status, started: float, size: int = 0) -> None:
+        if self.metrics.enabled:
+            self.metrics.record(path, status, time.monotonic() - started, size)
+
+    def _retry_delay(
+        self, error: AiguesApiError, attempt: int, path: str = None
+    ) -> float | None:
+        """Account a failed attempt, return the delay before the next one.
+
+        Returns None when the request must not be retried.
+        """
+        self.stats["errors"] += 1
+        if error.server_side:
+            self.breaker.record_failure()
+        else:
+            # the API answered
+            self.breaker.record_success()
+
+        if not error.retryable or attempt >= RETRY_ATTEMPTS or self.breaker.is_open:
+            return None
+        if error.retry_after is not None and error.retry_after > RETRY_BACKOFF_MAX:
+            return None
+
+        self.stats["retries"] += 1
+        if self.metrics.enabled and path:
+            self.metrics.record_retry(path)
+        delay = backoff_delay(attempt, error.retry_after)
+        _LOGGER.warning(f"{error}, retrying in {delay:.1f}s")
+        return delay
 
-    def login(self, user=None, password=None, recaptcha=None):
+    def is_token_expired(self) -> bool:
+        """Check if Token in cookie has expired or not."""
+        return self.token_manager.is_expired()
+
+    def _login_request(self, user=None, password=None, recaptcha=None) -> dict:
         if user is None:
             user = self._username
         if password is None:
@@ -127,14 +512,21 @@ class AiguesApiClient:
             "Content-Type": "application/json",
             "Ocp-Apim-Subscription-Key": "6a98b8b8c7b243cda682a43f09e6588b;product=portlet-login-ofex",
         }
+        return {
+            "path": path,
+            "query": query,
+            "json": body,
+            "headers": headers,
+            "method": "POST",
+        }
 
-        r = self._query(path, query, body, headers, method="POST")
-
-        error = r.json().get("errorMessage", None)
+    @staticmethod
+    def _parse_login(data) -> bool:
+        error = data.get("errorMessage", None)
         if error:
             return False
 
-        access_token = r.json().get("access_token", None)
+        access_token = data.get("access_token", None)
         if not access_token:
             return False
 
@@ -143,31 +535,7 @@ class AiguesApiClient:
         # set as cookie: ofexTokenJwt
         # https://www.aiguesdebarcelona.cat/ca/area-clientes
 
-    def set_token(self, token: str):
-        host = ".".join(self.api_host.split(".")[1:])
-        cookie_data = {
-            "name": API_COOKIE_TOKEN,
-            "value": token,
-            "domain": f".{host}",
-            "path": "/",
-            "secure": True,
-            "rest": {"HttpOnly": True, "SameSite": "None"},
-        }
-        cookie = requests.cookies.create_cookie(**cookie_data)
-        return self.cli.cookies.set_cookie(cookie)
-
-    def is_token_expired(self) -> bool:
-        """Check if Token in cookie has expired or not."""
-        expires = self._return_token_field("exp")
-        if not expires:
-            return True
-
-        expires = datetime.datetime.fromtimestamp(expires)
-        NOW = datetime.datetime.now()
-
-        return NOW >= expires
-
-    def profile(self, user=None):
+    def _profile_request(self, user=None) -> dict:
         if user is None:
             user = self._return_token_field("name")
 
@@ -176,13 +544,14 @@ class AiguesApiClient:
         headers = {
             "Ocp-Apim-Subscription-Key": "6a98b8b8c7b243cda682a43f09e6588b;product=portlet-login-ofex"
         }
+        return {"path": path, "query": query, "headers": headers, "method": "POST"}
 
-        r = self._query(path, query, headers=headers, method="POST")
-
-        assert r.json().get("user_data"), "User data missing"
-        return r.json()
+    @staticmethod
+    def _parse_profile(data):
+        assert data.get("user_data"), "User data missing"
+        return data
 
-    def contracts(self, user=None, status=None):
+    def _contracts_request(self, user=None, status=None) -> dict:
         if user is None:
             user = self._return_token_field("name")
         if status is None:
@@ -204,29 +573,13 @@ class AiguesApiClient:
                 query["assignationStatus"] = (
                     f"{query['assignationStatus']}&assignationStatus={stat.upper()}"
                 )
+        return {"path": path, "query": query}
 
-        r = self._query(path, query)
-
-        data = r.json().get("data")
-        return data
-
-    @property
-    def contract_id(self):
-        return [x["contractDetail"]["contractNumber"] for x in self.contracts()]
-
-    @property
-    def first_contract(self):
-        contract_ids = self.contract_id
-        assert (
-            len(contract_ids) == 1
-        ), "Provide a Contract ID to retrieve specific invoices"
-        return contract_ids[0]
-
-    def invoices(self, contract=None, user=None, last_months=36, mode="ALL"):
+    def _invoices_request(
+        self, contract, user=None, last_months=36, mode="ALL"
+    ) -> dict:
         if user is None:
             user = self._return_token_field("name")
-        if contract is None:
-            contract = self.first_contract
 
         path = "/ofex-invoices-api/invoices"
         query = {
@@ -237,18 +590,11 @@ class AiguesApiClient:
             "lastMonths": last_months,
             "mode": mode,
         }
+        return {"path": path, "query": query}
 
-        r = self._query(path, query)
-
-        data = r.json().get("data")
-        return data
-
-    def invoices_debt(self, contract=None, user=None):
-        return self.invoices(contract, user, last_months=0, mode="DEBT")
-
-    def consumptions(
+    def _consumptions_request(
         self, date_from, date_to, contract=None, user=None, frequency="HOURLY"
-    ):
+    ) -> dict:
         if user is None:
             user = self._username
         if contract is None:
@@ -265,25 +611,321 @@ class AiguesApiClient:
             "toDate": date_to.strftime("%d-%m-%Y"),
             "showNegativeValues": "false",
         }
+        return {"path": path, "query": query}
 
-        r = self._query(path, query)
-
-        data = r.json().get("data")
-        return data
+    @staticmethod
+    def _parse_data(data):
+        return data.get("data")
 
-    def consumptions_week(self, date_from: datetime.date, contract=None, user=None):
+    @staticmethod
+    def _week_range(date_from: datetime.date):
         if date_from is None:
             date_from = datetime.datetime.now()
         # get first day of week
         monday = date_from - datetime.timedelta(days=date_from.weekday())
         sunday = monday + datetime.timedelta(days=6)
-        return self.consumptions(monday, sunday, contract, user, frequency="DAILY")
+        return monday, sunday
 
-    def consumptions_month(self, date_from: datetime.date, contract=None, user=None):
+    @staticmethod
+    def _month_range(date_from: datetime.date):
         first = date_from.replace(day=1)
         next_month = date_from.replace(day=28) + datetime.timedelta(days=4)
         last = next_month - datetime.timedelta(days=next_month.day)
+        return first, last
+
+    @staticmethod
+    def _parse_consumptions(data) -> list[ConsumptionRecord]:
+        return [ConsumptionRecord.from_api(x) for x in data.get("data") or []]
+
+    def parse_consumptions(self, info, key="accumulated_consumption"):
+        return [getattr(x, key) for x in info]
+
+
+class AiguesApiClient(_AiguesApiBase):
+    """Blocking client based on requests, usable from scripts."""
+
+    def __init__(
+        self,
+        username,
+        password,
+        contract=None,
+        session: requests.Session = None,
+        company_identification=None,
+    ):
+        super().__init__(
+            username,
+            password,
+            contract,
+            company_identification=company_identification,
+        )
+        if session is None:
+            session = requests.Session()
+        self.cli = session
+
+    def _query(self, path, query=None, json=None, headers=None, method="GET"):
+        if headers is None:
+            headers = dict()
+        url = self._generate_url(path, query)
+        cache_key, ttl, cached = self._cache_lookup(method, url)
+        if cached and self.response_cache.is_fresh(cached):
+            return cached["value"]
+        headers = {**self.headers, **self.response_cache.validators(cached), **headers}
+
+        attempt = 0
+        while True:
+            self.breaker.check()
+            self.stats["requests"] += 1
+            started = time.monotonic()
+            try:
+                try:
+                    resp = self.cli.request(
+                        method=method,
+                        url=url,
+                        json=json,
+                        headers=headers,
+                        timeout=TIMEOUT,
+                    )
+                except requests.exceptions.RequestException as e:
+                    self._record(path, None, started)
+                    _LOGGER.error(f"Request failed: {str(e)}")
+                    raise RequestFailedError(f"Request failed: {str(e)}") from e
+                self._record(path, resp.status_code, started, len(resp.content))
+
+                if resp.status_code == 304 and cached:
+                    self.breaker.record_success()
+                    return self.response_cache.refresh(cache_key, ttl)
+                data = self._process_response(
+                    resp.status_code, resp.content, resp.headers
+                )
+            except AiguesApiError as e:
+                delay = self._retry_delay(e, attempt, path)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self.breaker.record_success()
+            if cache_key:
+                self.response_cache.set(cache_key, data, ttl, resp.headers)
+            return data
+
+    def login(self, user=None, password=None, recaptcha=None):
+        data = self._query(**self._login_request(user, password, recaptcha))
+        return self._parse_login(data)
+
+    def set_token(self, token: str):
+        host = ".".join(self.api_host.split(".")[1:])
+        cookie_data = {
+            "name": API_COOKIE_TOKEN,
+            "value": token,
+            "domain": f".{host}",
+            "path": "/",
+            "secure": True,
+            "rest": {"HttpOnly": True, "SameSite": "None"},
+        }
+        cookie = requests.cookies.create_cookie(**cookie_data)
+        self.token_manager.set(token)
+        return self.cli.cookies.set_cookie(cookie)
+
+    def profile(self, user=None):
+        data = self._query(**self._profile_request(user))
+        return self._parse_profile(data)
+
+    def contracts(self, user=None, status=None):
+        data = self._query(**self._contracts_request(user, status))
+        return self._parse_data(data)
+
+    @property
+    def contract_id(self):
+        return [x["contractDetail"]["contractNumber"] for x in self.contracts()]
+
+    @property
+    def first_contract(self):
+        contract_ids = self.contract_id
+        assert (
+            len(contract_ids) == 1
+        ), "Provide a Contract ID to retrieve specific invoices"
+        return contract_ids[0]
+
+    def invoices(self, contract=None, user=None, last_months=36, mode="ALL"):
+        if contract is None:
+            contract = self.first_contract
+
+        data = self._query(**self._invoices_request(contract, user, last_months, mode))
+        return self._parse_data(data)
+
+    def invoices_debt(self, contract=None, user=None):
+        return self.invoices(contract, user, last_months=0, mode="DEBT")
+
+    def consumptions(
+        self, date_from, date_to, contract=None, user=None, frequency="HOURLY"
+    ):
+        data = self._query(
+            **self._consumptions_request(date_from, date_to, contract, user, frequency)
+        )
+        return self._parse_consumptions(data)
+
+    def consumptions_week(self, date_from: datetime.date, contract=None, user=None):
+        monday, sunday = self._week_range(date_from)
+        return self.consumptions(monday, sunday, contract, user, frequency="DAILY")
+
+    def consumptions_month(self, date_from: datetime.date, contract=None, user=None):
+        first, last = self._month_range(date_from)
         return self.consumptions(first, last, contract, user, frequency="DAILY")
 
-    def parse_consumptions(self, info, key="accumulatedConsumption"):
-        return [x[key] for x in info]
+
+class AsyncAiguesApiClient(_AiguesApiBase):
+    """Non-blocking client based on aiohttp.
+
+    Pass a shared ``session`` (see ``create_session``) so all clients
+    reuse the same connection pool. If none is provided, a private
+    session is created and must be released with ``close``.
+    """
+
+    def __init__(
+        self,
+        username,
+        password,
+        contract=None,
+        session=None,
+        company_identification=None,
+        limit=None,
+    ):
+        super().__init__(
+            username,
+            password,
+            contract,
+            company_identification=company_identification,
+        )
+        self._session = session
+        self._owns_session = session is None
+        # requests in flight, the shared pool has no limit per client
+        self._limiter = asyncio.Semaphore(limit) if limit else None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = create_session()
+            self._owns_session = True
+        return self._session
+
+    async def close(self) -> None:
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def set_token(self, token: str):
+        self.token_manager.set(token)
+
+    async def _query(self, path, query=None, json=None, headers=None, method="GET"):
+        if headers is None:
+            headers = dict()
+        url = self._generate_url(path, query)
+        cache_key, ttl, cached = self._cache_lookup(method, url)
+        if cached and self.response_cache.is_fresh(cached):
+            return cached["value"]
+        headers = {**self.headers, **self.response_cache.validators(cached), **headers}
+        if self.token_manager.token:
+            # the session does not keep cookies, send the token explicitly
+            headers["Cookie"] = f"{API_COOKIE_TOKEN}={self.token_manager.token}"
+
+        attempt = 0
+        while True:
+            self.breaker.check()
+            self.stats["requests"] += 1
+            started = time.monotonic()
+            try:
+                try:
+                    async with self._limiter or contextlib.nullcontext():
+                        async with self.session.request(
+                            method,
+                            url,
+                            json=json,
+                            headers=headers,
+                            timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+                        ) as resp:
+                            status = resp.status
+                            body = await resp.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self._record(path, None, started)
+                    _LOGGER.error(f"Request failed: {str(e)}")
+                    raise RequestFailedError(f"Request failed: {str(e)}") from e
+                self._record(path, status, started, len(body))
+
+                if status == 304 and cached:
+                    self.breaker.record_success()
+                    return self.response_cache.refresh(cache_key, ttl)
+                data = self._process_response(status, body, resp.headers)
+            except AiguesApiError as e:
+                delay = self._retry_delay(e, attempt, path)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            self.breaker.record_success()
+            if cache_key:
+                self.response_cache.set(cache_key, data, ttl, resp.headers)
+            return data
+
+    async def login(self, user=None, password=None, recaptcha=None):
+        data = await self._query(**self._login_request(user, password, recaptcha))
+        if not self._parse_login(data):
+            return False
+        # the session does not keep the cookie set by the login
+        self.set_token(data["access_token"])
+        return True
+
+    async def profile(self, user=None):
+        data = await self._query(**self._profile_request(user))
+        return self._parse_profile(data)
+
+    async def contracts(self, user=None, status=None):
+        data = await self._query(**self._contracts_request(user, status))
+        return self._parse_data(data)
+
+    async def contract_id(self):
+        return [x["contractDetail"]["contractNumber"] for x in await self.contracts()]
+
+    async def first_contract(self):
+        contract_ids = await self.contract_id()
+        assert (
+            len(contract_ids) == 1
+        ), "Provide a Contract ID to retrieve specific invoices"
+        return contract_ids[0]
+
+    async def invoices(self, contract=None, user=None, last_months=36, mode="ALL"):
+        if contract is None:
+            contract = await self.first_contract()
+
+        data = await self._query(
+            **self._invoices_request(contract, user, last_months, mode)
+        )
+        return self._parse_data(data)
+
+    async def invoices_debt(self, contract=None, user=None):
+        return await self.invoices(contract, user, last_months=0, mode="DEBT")
+
+    async def consumptions(
+        self, date_from, date_to, contract=None, user=None, frequency="HOURLY"
+    ):
+        data = await self._query(
+            **self._consumptions_request(date_from, date_to, contract, user, frequency)
+        )
+        return self._parse_consumptions(data)
+
+    async def consumptions_week(
+        self, date_from: datetime.date, contract=None, user=None
+    ):
+        monday, sunday = self._week_range(date_from)
+        return await self.consumptions(
+            monday, sunday, contract, user, frequency="DAILY"
+        )
+
+    async def consumptions_month(
+        self, date_from: datetime.date, contract=None, user=None
+    ):
+        first, last = self._month_range(date_from)
+        return await self.consumptions(first, last, contract, user, frequency="DAILY")
@@ -0,0 +1,252 @@
+"""Planning and fetching of historical consumption data."""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import date
+from datetime import datetime
+from datetime import time as dt_time
+from datetime import timedelta
+from typing import Awaitable
+from typing import Callable
+
+from .api import ConsumptionRecord
+from .const import BACKFILL_CONCURRENCY
+from .const import BACKFILL_DAILY_WINDOW_DAYS
+from .const import BACKFILL_WINDOW_DAYS
+
+_LOGGER = logging.getLogger(__name__)
+
+FREQUENCY_HOURLY = "HOURLY"
+FREQUENCY_DAILY = "DAILY"
+
+WINDOW_DAYS = {
+    FREQUENCY_HOURLY: BACKFILL_WINDOW_DAYS,
+    FREQUENCY_DAILY: BACKFILL_DAILY_WINDOW_DAYS,
+}
+
+
+@dataclass
+class BackfillResult:
+    """Merged rows of a backfill and how much it cost to get them."""
+
+    rows: list = field(default_factory=list)
+    requests: int = 0
+    failed: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+
+@dataclass
+class BackfillProgress:
+    """Checkpoint of a backfill, saved so it resumes after a restart.
+
+    ``done`` keeps the windows already fetched, by frequency, as ranges
+    of ISO dates; they are not asked for again, even when empty.
+    """
+
+    date_from: date | None = None
+    date_to: date | None = None
+    done: dict = field(default_factory=dict)
+    windows_total: int = 0
+    windows_done: int = 0
+    rows: int = 0
+    started: datetime | None = None
+    finished: datetime | None = None
+    # windows done since this process started it, for the ETA
+    session_done: int = field(default=0, compare=False)
+    session_started: float | None = field(default=None, compare=False)
+
+    @property
+    def active(self) -> bool:
+        return self.date_from is not None and self.finished is None
+
+    @property
+    def percent(self) -> float | None:
+        if self.date_from is None:
+            return None
+        if self.finished or not self.windows_total:
+            return 100.0
+        return round(100 * self.windows_done / self.windows_total, 1)
+
+    @property
+    def eta(self) -> datetime | None:
+        """Estimated end, from the pace of the windows done until now."""
+        if not self.active or not self.session_done:
+            return None
+        elapsed = time.monotonic() - self.session_started
+        left = self.windows_total - self.windows_done
+        return datetime.now().astimezone() + timedelta(
+            seconds=elapsed / self.session_done * left
+        )
+
+    def done_ranges(self, frequency: str) -> list[tuple[date, date]]:
+        return [
+            (date.fromisoformat(lo), date.fromisoformat(hi))
+            for lo, hi in self.done.get(frequency, [])
+        ]
+
+    def start(self, windows: int) -> None:
+        """Start or resume the backfill with ``windows`` left to fetch."""
+        self.windows_total = self.windows_done + windows
+        self.session_done = 0
+        self.session_started = time.monotonic()
+
+    def window_done(self, frequency: str, window: tuple[datetime, datetime]) -> None:
+        self.done.setdefault(frequency, []).append(
+            [window[0].date().isoformat(), window[1].date().isoformat()]
+        )
+        self.windows_done += 1
+        self.session_done += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "date_from": self.date_from.isoformat() if self.date_from else None,
+            "date_to": self.date_to.isoformat() if self.date_to else None,
+            "done": self.done,
+            "windows_total": self.windows_total,
+            "windows_done": self.windows_done,
+            "rows": self.rows,
+            "started": self.started.isoformat() if self.started else None,
+            "finished": self.finished.isoformat() if self.finished else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BackfillProgress":
+        progress = cls(
+            done=data.get("done", {}),
+            windows_total=data.get("windows_total", 0),
+            windows_done=data.get("windows_done", 0),
+            rows=data.get("rows", 0),
+        )
+        for name in ("date_from", "date_to"):
+            if data.get(name):
+                setattr(progress, name, date.fromisoformat(data[name]))
+        for name in ("started", "finished"):
+            if data.get(name):
+                setattr(progress, name, datetime.fromisoformat(data[name]))
+        return progress
+
+
+def plan_windows(
+    date_from: datetime, date_to: datetime, max_days: int = BACKFILL_WINDOW_DAYS
+) -> list[tuple[datetime, datetime]]:
+    """Split a date range in the fewest windows accepted by the API.
+
+    Both ends of each window are included, as in the API ``fromDate``
+    and ``toDate`` parameters.
+    """
+    windows = list()
+    start = date_from
+    while start.date() <= date_to.date():
+        end = min(start + timedelta(days=max_days - 1), date_to)
+        windows.append((start, end))
+        start = end + timedelta(days=1)
+    return windows
+
+
+def _days(ranges) -> set[date]:
+    days = set()
+    for date_from, date_to in ranges:
+        day = date_from
+        while day <= date_to:
+            days.add(day)
+            day += timedelta(days=1)
+    return days
+
+
+def _runs(days) -> list[tuple[date, date]]:
+    runs = list()
+    for day in sorted(days):
+        if runs and runs[-1][1] == day - timedelta(days=1):
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+
+def plan_resolutions(
+    hourly_missing, daily_missing, hourly_from: date, done: BackfillProgress = None
+) -> dict[str, list[tuple[datetime, datetime]]]:
+    """Plan the windows to fetch at each resolution.
+
+    ``hourly_missing`` and ``daily_missing`` are runs of days, both ends
+    included, without hourly or daily records. The days from
+    ``hourly_from`` on are asked for by hour; older days only by day,
+    and only when there are no records of them at all. Days in the
+    windows ``done`` by a resumed backfill are skipped.
+    """
+    hourly = _days(hourly_missing)
+    daily = _days(daily_missing)
+    if done is not None:
+        hourly -= _days(done.done_ranges(FREQUENCY_HOURLY))
+        daily -= _days(done.done_ranges(FREQUENCY_DAILY))
+    recent = {day for day in hourly if day >= hourly_from}
+    old = (hourly - recent) & daily
+
+    plan = dict()
+    for frequency, days in ((FREQUENCY_DAILY, old), (FREQUENCY_HOURLY, recent)):
+        plan[frequency] = list()
+        for date_from, date_to in _runs(days):
+            plan[frequency] += plan_windows(
+                datetime.combine(date_from, dt_time()),
+                datetime.combine(date_to, dt_time()),
+                WINDOW_DAYS[frequency],
+            )
+    return plan
+
+
+def merge_consumptions(*batches) -> list[ConsumptionRecord]:
+    """Merge consumption batches sorted by datetime, without duplicates.
+
+    When the same datetime is found more than once, the last batch
+    wins.
+    """
+    merged = dict()
+    for batch in batches:
+        for metric in batch or []:
+            merged[metric.datetime] = metric
+    return [merged[when] for when in sorted(merged)]
+
+
+async def async_fetch_windows(
+    fetch: Callable[[datetime, datetime], Awaitable[list]],
+    windows: list[tuple[datetime, datetime]],
+    concurrency: int = BACKFILL_CONCURRENCY,
+    on_window: Callable[[tuple, list], Awaitable] = None,
+) -> BackfillResult:
+    """Fetch all windows with bounded concurrency and merge the rows.
+
+    ``on_window`` is awaited with each window fetched and its rows, to
+    store them as soon as they arrive.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    result = BackfillResult()
+    started = time.monotonic()
+
+    async def _fetch(window):
+        async with semaphore:
+            result.requests += 1
+            response = await fetch(*window)
+        if on_window is not None:
+            await on_window(window, response or [])
+        return response
+
+    responses = await asyncio.gather(
+        *[_fetch(window) for window in windows], return_exceptions=True
+    )
+
+    batches = list()
+    for window, response in zip(windows, responses):
+        if isinstance(response, Exception):
+            _LOGGER.warning(f"Failed to fetch {window[0]:%d-%m-%Y}: {response}")
+            result.failed.append(window)
+        elif not response:
+            _LOGGER.warning(f"No data available for {window[0]:%d-%m-%Y}")
+        else:
+            batches.append(response)
+
+    result.rows = merge_consumptions(*batches)
+    result.elapsed = time.monotonic() - started
+    return result
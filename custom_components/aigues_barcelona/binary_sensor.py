@@ -0,0 +1,62 @@
+"""Platform for binary sensor integration."""
+
+import logging
+
+from homeassistant.components.binary_sensor import BinarySensorDeviceClass
+from homeassistant.components.binary_sensor import BinarySensorEntity
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from .const import DOMAIN
+from .leak import PROBLEM_CONTINUOUS_FLOW
+from .leak import PROBLEM_NIGHT_FLOW
+from .leak import PROBLEM_SPIKE
+
+_LOGGER = logging.getLogger(__name__)
+
+PROBLEM_NAMES = {
+    PROBLEM_CONTINUOUS_FLOW: "Flujo continuo",
+    PROBLEM_NIGHT_FLOW: "Consumo nocturno",
+    PROBLEM_SPIKE: "Pico de consumo",
+}
+
+
+async def async_setup_entry(hass: HomeAssistant, config_entry, async_add_entities):
+    """Set up entry."""
+    coordinator = hass.data[DOMAIN][config_entry.entry_id]
+
+    async_add_entities(
+        FugaAgua(coordinator, contrato, problem)
+        for contrato in coordinator.contracts.values()
+        for problem in PROBLEM_NAMES
+    )
+
+    return True
+
+
+class FugaAgua(CoordinatorEntity, BinarySensorEntity):
+    """Possible leak found in the readings of a contract."""
+
+    def __init__(self, coordinator, contrato, problem: str) -> None:
+        super().__init__(coordinator)
+        self.contrato = contrato
+        self.problem = problem
+        self._attr_name = f"{PROBLEM_NAMES[problem]} {contrato.id}"
+        self._attr_unique_id = f"{contrato.id}_{problem}"
+        self._attr_icon = "mdi:water-alert"
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self._attr_device_class = BinarySensorDeviceClass.PROBLEM
+
+    @property
+    def is_on(self) -> bool:
+        return self.contrato.leaks.problems[self.problem]
+
+    @property
+    def extra_state_attributes(self):
+        leaks = self.contrato.leaks
+        if self.problem == PROBLEM_CONTINUOUS_FLOW:
+            return {"hours": leaks.flowing_hours}
+        if self.problem == PROBLEM_NIGHT_FLOW:
+            return {"flow": leaks.last_night_min}
+        return {"flow": leaks.spike}
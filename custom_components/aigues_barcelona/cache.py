@@ -0,0 +1,242 @@
+"""On-disk cache of the consumption records fetched for a contract."""
+
+import asyncio
+import logging
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import STORAGE_DIR
+from homeassistant.util import dt as dt_util
+
+from .api import ConsumptionRecord
+from .const import DOMAIN
+from .series import ConsumptionSeries
+
+_LOGGER = logging.getLogger(__name__)
+
+# epoch seconds of the measure, accumulated consumption
+RECORD = struct.Struct("<qd")
+
+# rewrite the file when it holds this many superseded records
+COMPACT_THRESHOLD = 1000
+
+
+class ConsumptionCache:
+    """Append-only file of ``(timestamp, accumulatedConsumption)`` records.
+
+    The file is read the first time the cache is used and kept in
+    memory as two sorted arrays, so looking up a timestamp is a binary
+    search. New or corrected records are appended to the file; when a
+    timestamp is written again, the last record wins.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._ts = array("q")
+        self._values = array("d")
+        self._loaded = False
+        self._stale = 0
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ts)
+
+    @property
+    def first(self) -> datetime | None:
+        if not self._ts:
+            return None
+        return dt_util.utc_from_timestamp(self._ts[0])
+
+    @property
+    def last(self) -> datetime | None:
+        if not self._ts:
+            return None
+        return dt_util.utc_from_timestamp(self._ts[-1])
+
+    def load(self) -> None:
+        """Read the file from disk. Blocking."""
+        self._ts = array("q")
+        self._values = array("d")
+        self._stale = 0
+        try:
+            with open(self.path, "rb") as fp:
+                raw = fp.read()
+        except FileNotFoundError:
+            raw = b""
+
+        size = len(raw) - len(raw) % RECORD.size
+        if size != len(raw):
+            # torn write, drop the partial record so appends stay aligned
+            _LOGGER.warning(
+                f"Dropping {len(raw) - size} bytes of a partial record in {self.path}"
+            )
+            with open(self.path, "r+b") as fp:
+                fp.truncate(size)
+        records = dict(RECORD.iter_unpack(raw[:size]))
+        self._stale = size // RECORD.size - len(records)
+        for ts in sorted(records):
+            self._ts.append(ts)
+            self._values.append(records[ts])
+        self._loaded = True
+        _LOGGER.debug(f"Loaded {len(self._ts)} cached records from {self.path}")
+
+    def merge(self, records) -> bytes:
+        """Merge API records in memory, return what has to be appended."""
+        packed = bytearray()
+        for metric in records:
+            ts = int(metric.datetime.timestamp())
+            value = metric.accumulated_consumption
+
+            pos = bisect_left(self._ts, ts)
+            if pos < len(self._ts) and self._ts[pos] == ts:
+                if self._values[pos] == value:
+                    continue
+                self._values[pos] = value
+                self._stale += 1
+            else:
+                self._ts.insert(pos, ts)
+                self._values.insert(pos, value)
+            packed += RECORD.pack(ts, value)
+        return bytes(packed)
+
+    def append(self, data: bytes) -> None:
+        """Append packed records to the file. Blocking."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "ab") as fp:
+            fp.write(data)
+
+    def clear(self) -> None:
+        """Forget all records and remove the file. Blocking."""
+        self._ts = array("q")
+        self._values = array("d")
+        self._stale = 0
+        self._loaded = True
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def forget(self, start: datetime, end: datetime) -> int:
+        """Drop the records in ``[start, end)``, return how many. Blocking."""
+        lo = bisect_left(self._ts, int(start.timestamp()))
+        hi = bisect_left(self._ts, int(end.timestamp()))
+        if lo < hi:
+            del self._ts[lo:hi]
+            del self._values[lo:hi]
+            self.compact()
+        return hi - lo
+
+    def compact(self) -> None:
+        """Rewrite the file without superseded records. Blocking."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as fp:
+            for ts, value in zip(self._ts, self._values):
+                fp.write(RECORD.pack(ts, value))
+        os.replace(tmp_path, self.path)
+        self._stale = 0
+
+    async def async_load(self, hass: HomeAssistant) -> None:
+        async with self._lock:
+            if not self._loaded:
+                await hass.async_add_executor_job(self.load)
+
+    async def async_add(self, hass: HomeAssistant, records) -> int:
+        """Store API records, return how many were new or changed."""
+        await self.async_load(hass)
+        async with self._lock:
+            data = self.merge(records)
+            if data:
+                await hass.async_add_executor_job(self.append, data)
+            if self._stale >= COMPACT_THRESHOLD:
+                await hass.async_add_executor_job(self.compact)
+        return len(data) // RECORD.size
+
+    async def async_forget(self, hass: HomeAssistant, start: datetime, end: datetime):
+        """Drop the records in ``[start, end)``, return how many."""
+        await self.async_load(hass)
+        async with self._lock:
+            return await hass.async_add_executor_job(self.forget, start, end)
+
+    def has(self, when: datetime) -> bool:
+        """Return whether a record for this exact time is cached."""
+        ts = int(when.timestamp())
+        pos = bisect_left(self._ts, ts)
+        return pos < len(self._ts) and self._ts[pos] == ts
+
+    def count(self, start: datetime, end: datetime) -> int:
+        """Return how many records are cached in ``[start, end)``."""
+        return bisect_left(self._ts, int(end.timestamp())) - bisect_left(
+            self._ts, int(start.timestamp())
+        )
+
+    def records(
+        self, start: datetime = None, end: datetime = None
+    ) -> list[ConsumptionRecord]:
+        """Return cached records in ``[start, end)``."""
+        lo = 0 if start is None else bisect_left(self._ts, int(start.timestamp()))
+        hi = (
+            len(self._ts)
+            if end is None
+            else bisect_left(self._ts, int(end.timestamp()))
+        )
+        return [
+            ConsumptionRecord(
+                dt_util.as_local(dt_util.utc_from_timestamp(self._ts[pos])),
+                self._values[pos],
+            )
+            for pos in range(lo, hi)
+        ]
+
+    def series(self, start: datetime = None, end: datetime = None):
+        """Return cached records in ``[start, end)`` as a series by hour."""
+        lo = 0 if start is None else bisect_left(self._ts, int(start.timestamp()))
+        hi = (
+            len(self._ts)
+            if end is None
+            else bisect_left(self._ts, int(end.timestamp()))
+        )
+        # records are sorted, the last one of each hour wins
+        hours = array("q")
+        values = array("d")
+        for pos in range(lo, hi):
+            hour = self._ts[pos] // 3600
+            if hours and hours[-1] == hour:
+                values[-1] = self._values[pos]
+            else:
+                hours.append(hour)
+                values.append(self._values[pos])
+        return ConsumptionSeries.from_arrays(hours, values)
+
+    def missing_ranges(self, date_from: date, date_to: date) -> list[tuple]:
+        """Return the runs of days, both ends included, without any record."""
+        missing = list()
+        day = date_from
+        while day <= date_to:
+            start = dt_util.start_of_local_day(day)
+            end = dt_util.start_of_local_day(day + timedelta(days=1))
+            if not self.count(start, end):
+                if missing and missing[-1][1] == day - timedelta(days=1):
+                    missing[-1] = (missing[-1][0], day)
+                else:
+                    missing.append((day, day))
+            day += timedelta(days=1)
+        return missing
+
+
+def get_cache(
+    hass: HomeAssistant, contract: str, kind: str = "consumptions"
+) -> ConsumptionCache:
+    """Return the consumption cache of a contract.
+
+    ``kind`` selects the file, the same format is used to remember the
+    statistics already written to the recorder.
+    """
+    return ConsumptionCache(
+        hass.config.path(STORAGE_DIR, DOMAIN, f"{contract.lower()}.{kind}")
+    )
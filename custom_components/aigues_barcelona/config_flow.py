@@ -11,15 +11,21 @@ from homeassistant import config_entries
 from homeassistant.const import CONF_PASSWORD
 from homeassistant.const import CONF_TOKEN
 from homeassistant.const import CONF_USERNAME
+from homeassistant.core import callback
 
 # from homeassistant.const import CONF_COMPANY_IDENTIFICATOR
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.exceptions import HomeAssistantError
 
-from .api import AiguesApiClient
+from .const import CONF_CONNECTION_LIMIT
+from .const import CONF_CONNECTION_LIMIT_PER_HOST
 from .const import CONF_CONTRACT
+from .const import CONF_METRICS
+from .const import DEFAULT_CONNECTION_LIMIT
+from .const import DEFAULT_CONNECTION_LIMIT_PER_HOST
 from .const import DOMAIN
 from .const import CONF_COMPANY_IDENTIFICATOR
+from .session import async_create_client
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -63,15 +69,15 @@ async def validate_credentials(
     company_identification = data.get(CONF_COMPANY_IDENTIFICATOR)
 
     try:
-        api = AiguesApiClient(
-            username, password, company_identification=company_identification
+        api = async_create_client(
+            hass, username, password, company_identification=company_identification
         )
         if token:
             api.set_token(token)
             if api.is_token_expired():
                 raise TokenExpired
         else:
-            login = await hass.async_add_executor_job(api.login)
+            login = await api.login()
             if not login:
                 if api.last_response and "recaptchaClientResponse" in str(
                     api.last_response
@@ -79,7 +85,7 @@ async def validate_credentials(
                     raise RecaptchaAppeared
                 raise InvalidAuth
 
-        contracts = await hass.async_add_executor_job(api.contracts, username)
+        contracts = await api.contracts(username)
         if not contracts:
             raise InvalidAuth
 
@@ -96,6 +102,11 @@ class AiguesBarcelonaConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     VERSION = 2
     stored_input = dict()
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return AiguesBarcelonaOptionsFlow(config_entry)
+
     async def async_step_token(
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
@@ -223,6 +234,43 @@ async def async_step_user(self, user_input: dict[str, Any] | None = None) -> Flo
     )
 
 
+class AiguesBarcelonaOptionsFlow(config_entries.OptionsFlow):
+    """Handle integration options."""
+
+    def __init__(self, config_entry) -> None:
+        self._config_entry = config_entry
+
+    async def async_step_init(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Manage the connection options."""
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        options = self._config_entry.options
+        schema = vol.Schema(
+            {
+                vol.Optional(
+                    CONF_CONNECTION_LIMIT,
+                    default=options.get(
+                        CONF_CONNECTION_LIMIT, DEFAULT_CONNECTION_LIMIT
+                    ),
+                ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+                vol.Optional(
+                    CONF_CONNECTION_LIMIT_PER_HOST,
+                    default=options.get(
+                        CONF_CONNECTION_LIMIT_PER_HOST,
+                        DEFAULT_CONNECTION_LIMIT_PER_HOST,
+                    ),
+                ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+                vol.Optional(
+                    CONF_METRICS, default=options.get(CONF_METRICS, False)
+                ): bool,
+            }
+        )
+        return self.async_show_form(step_id="init", data_schema=schema)
+
+
 class AlreadyConfigured(HomeAssistantError):
     """Error to indicate integration is already configured."""
 
@@ -1,16 +1,94 @@
 """Constants definition."""
 
+from datetime import timedelta
+
 DOMAIN = "aigues_barcelona"
 
 CONF_CONTRACT = "contract"
 CONF_VALUE = "value"
 CONF_COMPANY_IDENTIFICATOR = "company_identification"
+CONF_CONNECTION_LIMIT = "connection_limit"
+CONF_CONNECTION_LIMIT_PER_HOST = "connection_limit_per_host"
+CONF_METRICS = "metrics"
 
 ATTR_LAST_MEASURE = "Last measure"
 
 DEFAULT_SCAN_PERIOD = 14400
+MIN_SCAN_PERIOD = 1800
+MAX_SCAN_PERIOD = 43200
+
+# publications remembered to predict the next one
+SCHEDULER_HISTORY = 20
+# poll this long after new data is expected
+SCHEDULER_MARGIN = timedelta(minutes=10)
+# readings can be published this late, these days are always asked again
+PUBLICATION_MAX_DELAY = timedelta(days=4)
+
+DEFAULT_CONNECTION_LIMIT = 20
+DEFAULT_CONNECTION_LIMIT_PER_HOST = 10
+DEFAULT_CONNECTION_KEEPALIVE = 60
+
+ACCOUNT_UPDATE_CONCURRENCY = 4
+
+# first refresh after startup, spread in time and across accounts
+FIRST_REFRESH_JITTER = 30
+FIRST_REFRESH_CONCURRENCY = 2
+
+# invoices are issued every one or two months
+INVOICE_SCAN_PERIOD = 86400
+INVOICE_FULL_MONTHS = 36
+INVOICE_RECENT_MONTHS = 3
+
+# the web client asks for a full month at once
+BACKFILL_WINDOW_DAYS = 31
+# the API is only known to accept a month per request, whatever the
+# frequency, and a rejected window would fail again on every run
+BACKFILL_DAILY_WINDOW_DAYS = BACKFILL_WINDOW_DAYS
+# days before today fetched hour by hour, older ones only by day
+BACKFILL_HOURLY_DAYS = 31
+BACKFILL_CONCURRENCY = 4
+
+# statistics rows sent to the recorder in a single job
+IMPORT_CHUNK_SIZE = 500
+
+# recent readings kept in memory per contract, a bit over a month
+SERIES_MAX_HOURS = 24 * 35
+
+# flow in m3/h, the meter resolution is one litre
+LEAK_WINDOW_HOURS = 24 * 7
+LEAK_MIN_FLOW = 0.001
+LEAK_CONTINUOUS_HOURS = 24
+LEAK_NIGHT_HOURS = range(1, 6)
+LEAK_NIGHT_THRESHOLD = 0.005
+LEAK_SPIKE_FACTOR = 5
+LEAK_SPIKE_MIN = 0.3
+
+EVENT_LEAK = f"{DOMAIN}_leak"
+EVENT_BACKFILL = f"{DOMAIN}_backfill"
+
+STORAGE_VERSION = 1
+STORAGE_SAVE_DELAY = 10
 
 API_HOST = "api.aiguesdebarcelona.cat"
 API_COOKIE_TOKEN = "ofexTokenJwt"
 
 API_ERROR_TOKEN_REVOKED = "JWT Token Revoked"
+
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF_BASE = 2
+RETRY_BACKOFF_MAX = 60
+
+# seconds a response can be reused, by path prefix
+RESPONSE_CACHE_TTL = {
+    "/ofex-login-api/auth/getProfile": 3600,
+    "/ofex-contracts-api/": 3600,
+    "/ofex-invoices-api/": 21600,
+}
+RESPONSE_CACHE_SIZE = 128
+
+# consecutive failures before requests are paused, and for how long
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 300
+
+# start the reauth flow this long before the token expires
+TOKEN_EXPIRY_MARGIN = timedelta(minutes=5)
@@ -0,0 +1,648 @@
+"""Coordinators fetching the data of an Aigues de Barcelona account."""
+
+import asyncio
+import logging
+from datetime import date
+from datetime import datetime
+from datetime import time
+from datetime import timedelta
+from typing import Optional
+
+try:
+    from homeassistant.components.recorder.const import (
+        DATA_INSTANCE as RECORDER_DATA_INSTANCE,
+    )
+except ImportError:  # NEW Home Assistant 2024.08
+    from homeassistant.helpers.recorder import (
+        DATA_INSTANCE as RECORDER_DATA_INSTANCE,
+    )
+from homeassistant.components.recorder.statistics import clear_statistics
+from homeassistant.components.recorder.statistics import list_statistic_ids
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_STATE
+from homeassistant.const import CONF_TOKEN
+from homeassistant.core import callback
+from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import ConfigEntryAuthFailed
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+from homeassistant.helpers.update_coordinator import TimestampDataUpdateCoordinator
+from homeassistant.helpers.update_coordinator import UpdateFailed
+from homeassistant.util import dt as dt_util
+
+from .api import AsyncAiguesApiClient
+from .backfill import async_fetch_windows
+from .backfill import BackfillProgress
+from .backfill import FREQUENCY_DAILY
+from .backfill import FREQUENCY_HOURLY
+from .backfill import plan_resolutions
+from .backfill import plan_windows
+from .cache import get_cache
+from .const import ACCOUNT_UPDATE_CONCURRENCY
+from .const import API_ERROR_TOKEN_REVOKED
+from .const import BACKFILL_HOURLY_DAYS
+from .const import CONF_CONTRACT
+from .const import CONF_METRICS
+from .const import CONF_VALUE
+from .const import DEFAULT_SCAN_PERIOD
+from .const import DOMAIN
+from .const import EVENT_BACKFILL
+from .const import EVENT_LEAK
+from .const import INVOICE_SCAN_PERIOD
+from .const import PUBLICATION_MAX_DELAY
+from .const import SERIES_MAX_HOURS
+from .const import STORAGE_SAVE_DELAY
+from .const import STORAGE_VERSION
+from .importer import get_db_instance
+from .importer import StatisticsImporter
+from .invoices import InvoiceStore
+from .leak import LeakDetector
+from .metrics import PhaseTimings
+from .scheduler import PublicationModel
+from .series import ConsumptionSeries
+from .series import from_hour
+from .series import to_hour
+from .totals import ConsumptionTotals
+from .totals import PERIOD_MONTH
+from .totals import PERIOD_WEEK
+from .totals import period_start
+from .session import async_create_entry_client
+from .singleflight import RangeSingleFlight
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AiguesAccountCoordinator(TimestampDataUpdateCoordinator):
+    """Update all the contracts of a config entry in a single pass.
+
+    The account owns the API client, so the token is checked once per
+    cycle and the contracts share the same connection pool.
+    """
+
+    def __init__(self, hass: HomeAssistant, entry: ConfigEntry) -> None:
+        self.entry = entry
+        self.api = async_create_entry_client(hass, entry)
+        token = entry.data.get(CONF_TOKEN)
+        if token:
+            self.api.set_token(token)
+
+        self.contracts = {
+            contract.upper(): ContratoAgua(hass, self.api, contract, entry)
+            for contract in entry.data[CONF_CONTRACT]
+        }
+
+        # instrumentation, off unless enabled in the options
+        metrics = entry.options.get(CONF_METRICS, False)
+        self.api.metrics.enabled = metrics
+        self.timings = PhaseTimings(metrics)
+        for contrato in self.contracts.values():
+            contrato.timings.enabled = metrics
+
+        # invoices change monthly, they are updated on their own schedule
+        self.invoices = AiguesInvoiceCoordinator(hass, entry, self.api, self.contracts)
+
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=entry.title,
+            update_interval=timedelta(seconds=DEFAULT_SCAN_PERIOD),
+        )
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.name}>"
+
+    async def async_load_state(self) -> None:
+        """Restore the stored state of all contracts."""
+        await asyncio.gather(
+            *[contrato.async_load_state() for contrato in self.contracts.values()],
+            self.invoices.async_load_state(),
+        )
+
+    @callback
+    def async_resume_backfills(self) -> None:
+        """Resume the backfills interrupted by a restart."""
+        for contrato in self.contracts.values():
+            progress = contrato.backfill
+            if not progress.active:
+                continue
+            _LOGGER.info(
+                f"Resuming backfill of {contrato.contract} from {progress.date_from} "
+                f"to {progress.date_to}, {progress.windows_done} windows done"
+            )
+            self.entry.async_create_background_task(
+                self.hass,
+                contrato.async_run_backfill(progress.date_from, progress.date_to),
+                f"{DOMAIN} resume backfill {contrato.contract}",
+            )
+
+    async def _async_update_data(self):
+        if self.api.is_token_expired():
+            _LOGGER.error("Token has expired, cannot check consumptions.")
+            raise ConfigEntryAuthFailed
+        # TODO: change once recaptcha is fiexd
+        # await self.api.login()
+
+        semaphore = asyncio.Semaphore(ACCOUNT_UPDATE_CONCURRENCY)
+
+        async def _update(contrato):
+            async with semaphore:
+                return await contrato.async_update()
+
+        with self.timings.phase("update"):
+            results = await asyncio.gather(
+                *[_update(contrato) for contrato in self.contracts.values()],
+                return_exceptions=True,
+            )
+
+        data = dict()
+        for contract, result in zip(self.contracts, results):
+            # cancelled or exiting, not a failure of the contract
+            if isinstance(result, ConfigEntryAuthFailed) or (
+                isinstance(result, BaseException) and not isinstance(result, Exception)
+            ):
+                raise result
+            if isinstance(result, Exception):
+                _LOGGER.error(str(result))
+                continue
+            data[contract] = result
+
+        # poll again when new readings are expected
+        now = dt_util.utcnow()
+        self.update_interval = min(
+            (c.publication.next_poll(now) for c in self.contracts.values()),
+            default=timedelta(seconds=DEFAULT_SCAN_PERIOD),
+        )
+        _LOGGER.debug(f"Next update of {self.name} in {self.update_interval}")
+
+        if self.contracts and not data:
+            raise UpdateFailed("Failed to update all contracts")
+        return data
+
+
+class AiguesInvoiceCoordinator(DataUpdateCoordinator):
+    """Update the invoices and debt of all the contracts of an account."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry: ConfigEntry,
+        api: AsyncAiguesApiClient,
+        contracts: dict,
+    ) -> None:
+        self.api = api
+        self.stores = {
+            contract: InvoiceStore(hass, api, contract) for contract in contracts
+        }
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"{entry.title} invoices",
+            update_interval=timedelta(seconds=INVOICE_SCAN_PERIOD),
+        )
+
+    async def async_load_state(self) -> None:
+        await asyncio.gather(*[store.async_load() for store in self.stores.values()])
+
+    async def _async_update_data(self):
+        if self.api.is_token_expired():
+            # the consumptions coordinator asks for a new token
+            raise UpdateFailed("Token has expired, cannot check invoices")
+
+        results = await asyncio.gather(
+            *[store.async_update() for store in self.stores.values()],
+            return_exceptions=True,
+        )
+        data = dict()
+        for contract, result in zip(self.stores, results):
+            # cancelled or exiting, not a failure of the contract
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result
+            if isinstance(result, Exception):
+                _LOGGER.error(f"Failed to update invoices of {contract}: {result}")
+                continue
+            data[contract] = result
+
+        if self.stores and not data:
+            raise UpdateFailed("Failed to update the invoices of all contracts")
+        return data
+
+
+class ContratoAgua:
+    """Fetch and store the consumptions of a single contract."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        api: AsyncAiguesApiClient,
+        contract: str,
+        entry: ConfigEntry = None,
+    ) -> None:
+        """Initialize the data handler."""
+        self.hass = hass
+        self.contract = contract.upper()
+        self.id = contract.lower()
+        self.internal_sensor_id = f"sensor.contador_{self.id}"
+
+        if not hass.data[DOMAIN].get(self.contract):
+            # init data shared store
+            hass.data[DOMAIN][self.contract] = {}
+
+        # create alias
+        self._data = hass.data[DOMAIN][self.contract]
+
+        # WARN define a pointer to this object
+        hass.data[DOMAIN][self.contract]["coordinator"] = self
+
+        # the api object, shared with the other contracts of the account
+        self._api = api
+
+        # last hour imported to the recorder, publication model, running
+        # totals and leak detector, all survive restarts
+        self._watermark = None
+        self.publication = PublicationModel()
+        self.totals = ConsumptionTotals()
+        self.leaks = LeakDetector()
+        self.backfill = BackfillProgress()
+        self.timings = PhaseTimings()
+        self._state_loaded = False
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{self.id}")
+        # raw records already fetched, and statistics already written to
+        # the recorder, both survive restarts
+        self._cache = get_cache(hass, self.contract)
+        # older history is only fetched by day, kept apart from the hours
+        self._daily = get_cache(hass, self.contract, "daily")
+        self._written = get_cache(hass, self.contract, "written")
+        # recent readings by hour, bounded
+        self._data["consumptions"] = ConsumptionSeries(max_size=SERIES_MAX_HOURS)
+
+        # updates, services and the profiler share a single backfill at a
+        # time; the config entry cancels it when unloaded
+        if entry is not None:
+
+            def create_task(target, name):
+                return entry.async_create_background_task(hass, target, name)
+
+        else:
+            create_task = hass.async_create_background_task
+        self.backfills = RangeSingleFlight(
+            f"{DOMAIN} backfill {self.contract}", self._async_backfill, create_task
+        )
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.contract}>"
+
+    async def async_update(self) -> bool:
+        """Fetch new consumptions, return whether any data is available."""
+        _LOGGER.info(f"Updating coordinator data for {self.contract}")
+        TODAY = datetime.now()
+        LAST_WEEK = TODAY - timedelta(days=7)
+        LAST_TIME_DAYS = None
+
+        with self.timings.phase("state"):
+            watermark = await self.async_get_watermark()
+            await self._cache.async_load(self.hass)
+        _LOGGER.debug(f"Last stored measurement for {self.contract}: {watermark}")
+
+        if not self._data["consumptions"] and len(self._cache):
+            # show the last known values while the API is queried
+            since = dt_util.utcnow() - timedelta(hours=SERIES_MAX_HOURS)
+            self._async_add_series(self._cache.series(since))
+            if CONF_VALUE not in self._data:
+                self._async_set_last_metric(self._cache.records(self._cache.last)[-1])
+
+        # only ask for the days not stored yet
+        date_from = LAST_WEEK
+        if watermark:
+            last_stored = dt_util.as_local(watermark).replace(tzinfo=None)
+            LAST_TIME_DAYS = (TODAY - last_stored).days
+            date_from = max(last_stored, LAST_WEEK)
+        # late readings of the last days are still to come
+        date_from = min(date_from, TODAY - PUBLICATION_MAX_DELAY)
+
+        # the totals start with a reading from before the current week
+        # and month, or they would only count the hours seen since then
+        seed_since = None
+        if self.totals.last_hour is None:
+            hour = to_hour(dt_util.utcnow())
+            seed_since = min(
+                period_start(PERIOD_WEEK, hour), period_start(PERIOD_MONTH, hour)
+            ) - timedelta(hours=1)
+            date_from = min(date_from, seed_since.replace(tzinfo=None))
+
+        try:
+            with self.timings.phase("fetch"):
+                consumptions = await self._api.consumptions(
+                    date_from, TODAY, self.contract
+                )
+        except Exception as exp:
+            if API_ERROR_TOKEN_REVOKED in str(exp):
+                raise ConfigEntryAuthFailed from exp
+            raise UpdateFailed(f"Failed to update {self.contract}: {exp}") from exp
+
+        latest = None
+        if consumptions:
+            latest = dt_util.as_utc(max(x.datetime for x in consumptions))
+        self.publication.observe(dt_util.utcnow(), latest)
+        self._async_save_state()
+
+        if not consumptions:
+            _LOGGER.error("No consumptions available")
+            return False
+
+        with self.timings.phase("process"):
+            series = ConsumptionSeries.from_records(consumptions)
+            self._async_add_series(series)
+            totals = series
+            if seed_since is not None:
+                totals = self._cache.series(seed_since).merge(series)
+            if self.totals.add_series(totals):
+                self._async_save_state()
+            problems = self.leaks.update(series)
+        with self.timings.phase("cache"):
+            await self._cache.async_add(self.hass, consumptions)
+        for problem in problems:
+            _LOGGER.warning(f"Possible leak in {self.contract}: {problem}")
+            self.hass.bus.async_fire(
+                EVENT_LEAK, {CONF_CONTRACT: self.contract, "type": problem}
+            )
+
+        # get last entry - most updated
+        self._async_set_last_metric(consumptions[-1])
+
+        # only new or corrected hours reach the recorder
+        # await self._clear_statistics()
+        try:
+            with self.timings.phase("import"):
+                await self._async_import_statistics(series)
+        except Exception:
+            _LOGGER.exception(f"Failed to import statistics of {self.contract}")
+        else:
+            self.async_set_watermark(from_hour(series.last_hour))
+
+        if LAST_TIME_DAYS and LAST_TIME_DAYS >= 7:
+            with self.timings.phase("backfill"):
+                await self.import_old_consumptions(days=LAST_TIME_DAYS)
+
+        return True
+
+    @callback
+    def _async_add_series(self, series: ConsumptionSeries) -> None:
+        self._data["consumptions"] = self._data["consumptions"].merge(series)
+
+    @callback
+    def _async_set_last_metric(self, metric) -> None:
+        self._data[CONF_VALUE] = metric.accumulated_consumption
+        self._data[CONF_STATE] = metric.datetime
+
+    async def async_load_state(self) -> None:
+        if self._state_loaded:
+            return
+        stored = await self._store.async_load() or {}
+        self._state_loaded = True
+
+        if stored.get("watermark"):
+            self._watermark = datetime.fromisoformat(stored["watermark"])
+        self.publication = PublicationModel.from_dict(stored.get("publication", {}))
+        self.totals = ConsumptionTotals.from_dict(stored.get("totals", {}))
+        self.leaks = LeakDetector.from_dict(stored.get("leaks", {}))
+        self.backfill = BackfillProgress.from_dict(stored.get("backfill", {}))
+
+    @callback
+    def _async_save_state(self) -> None:
+        self._store.async_delay_save(self._state_to_save, STORAGE_SAVE_DELAY)
+
+    def _state_to_save(self) -> dict:
+        return {
+            "watermark": self._watermark.isoformat() if self._watermark else None,
+            "publication": self.publication.as_dict(),
+            "totals": self.totals.as_dict(),
+            "leaks": self.leaks.as_dict(),
+            "backfill": self.backfill.as_dict(),
+        }
+
+    async def async_get_watermark(self) -> Optional[datetime]:
+        """Return the start of the last hour already sent to the recorder.
+
+        Only the rows imported by the integration count: the recorder
+        also compiles statistics of the meter entity, with the same id,
+        up to the last hour.
+        """
+        await self.async_load_state()
+        if self._watermark is None:
+            await self._written.async_load(self.hass)
+            self._watermark = self._written.last
+        return self._watermark
+
+    @callback
+    def async_set_watermark(self, watermark: datetime) -> None:
+        if self._watermark and watermark <= self._watermark:
+            return
+        self._watermark = watermark
+        self._async_save_state()
+
+    async def _clear_statistics(self) -> None:
+        all_ids = await get_db_instance(self.hass).async_add_executor_job(
+            list_statistic_ids, self.hass
+        )
+        to_clear = [
+            x["statistic_id"]
+            for x in all_ids
+            if x["statistic_id"].startswith(self.internal_sensor_id)
+        ]
+
+        if to_clear:
+            _LOGGER.warn(
+                f"About to delete {len(to_clear)} entries from {self.contract}"
+            )
+            # NOTE: This does not seem to work?
+            await get_db_instance(self.hass).async_add_executor_job(
+                clear_statistics, self.hass.data[RECORDER_DATA_INSTANCE], to_clear
+            )
+
+    async def _async_import_statistics(self, *batches) -> int:
+        importer = StatisticsImporter(
+            self.hass, self.internal_sensor_id, written=self._written
+        )
+        for consumptions in batches:
+            importer.add(consumptions)
+        written = await importer.async_flush()
+        if importer.skipped:
+            _LOGGER.info(
+                f"Wrote {written} statistics rows of {self.contract}, "
+                f"skipped {importer.skipped} unchanged"
+            )
+        return written
+
+    async def clear_all_stored_data(self) -> None:
+        await self._clear_statistics()
+        await self.hass.async_add_executor_job(self._daily.clear)
+        await self.hass.async_add_executor_job(self._written.clear)
+        self._watermark = None
+        self._async_save_state()
+
+    async def async_history(self, date_from: date, date_to: date, fetch: bool = True):
+        """Yield the hourly records of a range of days, a window at a time.
+
+        Days without cached records are asked to the API when ``fetch``,
+        and cached as well.
+        """
+        await self._cache.async_load(self.hass)
+        for start, end in plan_windows(
+            datetime.combine(date_from, time()), datetime.combine(date_to, time())
+        ):
+            if fetch and self._cache.missing_ranges(start.date(), end.date()):
+                try:
+                    records = await self._api.consumptions(start, end, self.contract)
+                except Exception as exp:
+                    _LOGGER.warning(
+                        f"Failed to fetch {self.contract} for {start:%d-%m-%Y}: {exp}"
+                    )
+                else:
+                    if records:
+                        await self._cache.async_add(self.hass, records)
+            yield self._cache.records(
+                dt_util.start_of_local_day(start.date()),
+                dt_util.start_of_local_day(end.date() + timedelta(days=1)),
+            )
+
+    async def import_old_consumptions(self, days: int = 365) -> None:
+        """Backfill the last ``days``, or join the backfill running."""
+        today = datetime.now().date()
+        await self.backfills.async_run(today - timedelta(days=days), today)
+
+    async def async_run_backfill(
+        self, date_from: date, date_to: date, force: bool = False
+    ) -> None:
+        """Backfill a range of days as a background job, logging errors.
+
+        With ``force``, the hours already sent to the recorder are sent
+        again, in case its statistics were purged or lost.
+        """
+        try:
+            if force:
+                forgotten = await self._written.async_forget(
+                    self.hass,
+                    dt_util.start_of_local_day(date_from),
+                    dt_util.start_of_local_day(date_to + timedelta(days=1)),
+                )
+                _LOGGER.debug(
+                    f"Forgot {forgotten} hours sent to the recorder for {self.contract}"
+                )
+            await self.backfills.async_run(date_from, date_to)
+        except ConfigEntryAuthFailed:
+            _LOGGER.error(f"Token expired, backfill of {self.contract} stopped")
+        except Exception as exp:
+            _LOGGER.error(f"Backfill of {self.contract} failed: {exp}")
+
+    @callback
+    def _async_backfill_progress(self) -> None:
+        self._async_save_state()
+        progress = self.backfill
+        self.hass.bus.async_fire(
+            EVENT_BACKFILL,
+            {
+                CONF_CONTRACT: self.contract,
+                "date_from": progress.date_from.isoformat(),
+                "date_to": progress.date_to.isoformat(),
+                "windows_done": progress.windows_done,
+                "windows_total": progress.windows_total,
+                "rows": progress.rows,
+                "percent": progress.percent,
+                "eta": progress.eta.isoformat() if progress.eta else None,
+                "finished": progress.finished is not None,
+            },
+        )
+
+    def _daily_rows(self, records) -> list:
+        """Keep the daily records of days without hourly records.
+
+        They become a statistics row per day.
+        """
+        return [
+            metric
+            for metric in records
+            if not self._cache.count(
+                metric.datetime, metric.datetime + timedelta(days=1)
+            )
+        ]
+
+    async def _async_backfill(self, date_from: date, date_to: date) -> None:
+        hourly_from = datetime.now().date() - timedelta(days=BACKFILL_HOURLY_DAYS)
+
+        if self._api.is_token_expired():
+            raise ConfigEntryAuthFailed
+
+        # resume the same backfill if it was interrupted
+        await self.async_load_state()
+        progress = self.backfill
+        if not (
+            progress.active
+            and progress.date_from == date_from
+            and progress.date_to == date_to
+        ):
+            progress = self.backfill = BackfillProgress(
+                date_from, date_to, started=dt_util.utcnow()
+            )
+
+        # skip the days already in the cache
+        await self._cache.async_load(self.hass)
+        await self._daily.async_load(self.hass)
+        plan = plan_resolutions(
+            self._cache.missing_ranges(date_from, date_to),
+            self._daily.missing_ranges(date_from, date_to),
+            hourly_from,
+            progress,
+        )
+        progress.start(sum(len(windows) for windows in plan.values()))
+        self._async_backfill_progress()
+
+        for frequency, cache in (
+            (FREQUENCY_DAILY, self._daily),
+            (FREQUENCY_HOURLY, self._cache),
+        ):
+            if not plan[frequency]:
+                continue
+
+            async def fetch(date_from, date_to, frequency=frequency):
+                return await self._api.consumptions(
+                    date_from, date_to, self.contract, frequency=frequency
+                )
+
+            async def on_window(window, rows, frequency=frequency, cache=cache):
+                # checkpoint: the rows are on disk and in the statistics,
+                # do not ask again
+                if rows:
+                    await cache.async_add(self.hass, rows)
+                    if frequency == FREQUENCY_DAILY:
+                        rows = self._daily_rows(rows)
+                    if rows:
+                        written = await self._async_import_statistics(rows)
+                        progress.rows += written
+                progress.window_done(frequency, window)
+                self._async_backfill_progress()
+
+            result = await async_fetch_windows(
+                fetch, plan[frequency], on_window=on_window
+            )
+            _LOGGER.info(
+                f"Backfill of {self.contract} got {len(result.rows)} {frequency} "
+                f"rows in {result.requests} requests, took {result.elapsed:.1f}s"
+            )
+            if result.failed:
+                _LOGGER.warning(
+                    f"Backfill of {self.contract} missed {len(result.failed)} windows"
+                )
+
+        # records cached before, the ones just imported are skipped
+        since = dt_util.start_of_local_day(date_from)
+        until = dt_util.start_of_local_day(date_to + timedelta(days=1))
+        daily = self._daily_rows(self._daily.records(since, until))
+        rows = self._cache.series(since, until)
+        if rows or daily:
+            written = await self._async_import_statistics(daily, rows)
+            progress.rows += written
+
+        # failed windows are left for the next run
+        if progress.windows_done >= progress.windows_total:
+            progress.finished = dt_util.utcnow()
+        self._async_backfill_progress()
@@ -0,0 +1,80 @@
+"""Diagnostics support for Aigues de Barcelona."""
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_PASSWORD
+from homeassistant.const import CONF_TOKEN
+from homeassistant.const import CONF_USERNAME
+from homeassistant.core import HomeAssistant
+
+from .const import CONF_COMPANY_IDENTIFICATOR
+from .const import DOMAIN
+
+TO_REDACT = {CONF_USERNAME, CONF_PASSWORD, CONF_TOKEN, CONF_COMPANY_IDENTIFICATOR}
+
+
+def _range(days) -> list[str] | None:
+    return [day.isoformat() for day in days] if days else None
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict:
+    """Return diagnostics for a config entry."""
+    coordinator = hass.data[DOMAIN][entry.entry_id]
+    api = coordinator.api
+
+    contracts = dict()
+    for contract, contrato in coordinator.contracts.items():
+        watermark = await contrato.async_get_watermark()
+        contracts[contract] = {
+            "watermark": watermark.isoformat() if watermark else None,
+            "cached_records": len(contrato._cache),
+            "publication": contrato.publication.as_dict(),
+            "totals": contrato.totals.as_dict(),
+            "leaks": contrato.leaks.problems,
+            "timings": contrato.timings.as_dict(),
+            "backfill": {
+                "running": _range(contrato.backfills.running),
+                "pending": [_range(x) for x in contrato.backfills.pending],
+                "progress": contrato.backfill.as_dict(),
+            },
+        }
+        store = coordinator.invoices.stores.get(contract)
+        if store is not None:
+            contracts[contract]["invoices"] = {
+                "count": len(store.invoices),
+                "latest": store.latest,
+                "debt": store.debt_amount,
+                "full_fetched": (
+                    store.full_fetched.isoformat() if store.full_fetched else None
+                ),
+            }
+
+    return {
+        "entry": {
+            "data": async_redact_data(entry.data, TO_REDACT),
+            "options": dict(entry.options),
+        },
+        "api": {
+            "token_expires_at": (
+                api.token_manager.expires_at.isoformat()
+                if api.token_manager.expires_at
+                else None
+            ),
+            "stats": api.stats,
+            "circuit_breaker": api.breaker.as_dict(),
+            "response_cache": api.response_cache.stats,
+            "metrics": api.metrics.as_dict(),
+        },
+        "update": {
+            "last_update_success": coordinator.last_update_success,
+            "update_interval": str(coordinator.update_interval),
+            "timings": coordinator.timings.as_dict(),
+        },
+        "invoices_update": {
+            "last_update_success": coordinator.invoices.last_update_success,
+            "update_interval": str(coordinator.invoices.update_interval),
+        },
+        "contracts": contracts,
+    }
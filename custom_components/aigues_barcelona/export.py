@@ -0,0 +1,132 @@
+"""Streaming export of the consumption history to CSV or Parquet."""
+
+import csv
+import logging
+from datetime import date
+from typing import AsyncIterator
+
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+
+from .api import ConsumptionRecord
+from .const import DOMAIN
+from .series import ConsumptionSeries
+from .series import from_hour
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional, only needed for Parquet
+    pyarrow = None
+
+_LOGGER = logging.getLogger(__name__)
+
+FORMAT_CSV = "csv"
+FORMAT_PARQUET = "parquet"
+
+COLUMNS = ("contract", "datetime", "accumulated_consumption", "delta_consumption")
+
+
+async def async_iter_rows(
+    contract: str, batches: AsyncIterator[list[ConsumptionRecord]]
+) -> AsyncIterator[list[tuple]]:
+    """Turn batches of records into rows, with the consumption of each hour."""
+    # last reading of the previous batch, for the first hour of the next
+    last = ConsumptionSeries()
+    async for batch in batches:
+        series = last.merge(ConsumptionSeries.from_records(batch))
+        deltas = [round(delta, 4) for delta in series.deltas()]
+        if not last:
+            deltas.insert(0, None)
+        yield [
+            (contract, dt_util.as_local(from_hour(hour)), value, delta)
+            for hour, value, delta in zip(
+                series.hours[len(last) :], series.values[len(last) :], deltas
+            )
+        ]
+        if series:
+            last = series.slice(series.last_hour)
+
+
+class CsvExportWriter:
+    """Write rows to a CSV file as they come. Blocking."""
+
+    def __init__(self, path: str) -> None:
+        self._fp = open(path, "w", newline="")
+        self._writer = csv.writer(self._fp)
+        self._writer.writerow(COLUMNS)
+
+    def write(self, rows: list[tuple]) -> None:
+        self._writer.writerows(
+            (contract, when.isoformat(), value, delta)
+            for contract, when, value, delta in rows
+        )
+
+    def close(self) -> None:
+        self._fp.close()
+
+
+class ParquetExportWriter:
+    """Write rows to a Parquet file, a row group per batch. Blocking."""
+
+    def __init__(self, path: str) -> None:
+        self._schema = pyarrow.schema(
+            [
+                ("contract", pyarrow.string()),
+                ("datetime", pyarrow.timestamp("s", tz="UTC")),
+                ("accumulated_consumption", pyarrow.float64()),
+                ("delta_consumption", pyarrow.float64()),
+            ]
+        )
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, rows: list[tuple]) -> None:
+        columns = [list(column) for column in zip(*rows)]
+        self._writer.write_table(
+            pyarrow.Table.from_arrays(columns, schema=self._schema)
+        )
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+WRITERS = {
+    FORMAT_CSV: CsvExportWriter,
+    FORMAT_PARQUET: ParquetExportWriter,
+}
+
+
+async def async_export(
+    hass: HomeAssistant,
+    contratos: list,
+    date_from: date,
+    date_to: date,
+    file_format: str = FORMAT_CSV,
+    fetch: bool = True,
+    name: str = None,
+) -> str | None:
+    """Export the hourly history of the contracts, return the file path.
+
+    Records are read and written a window at a time, so memory does not
+    grow with the length of the range or the number of contracts.
+    """
+    if file_format == FORMAT_PARQUET and pyarrow is None:
+        _LOGGER.error("Exporting to Parquet requires the pyarrow package")
+        return None
+
+    prefix = f"{DOMAIN}_export_{name}" if name else f"{DOMAIN}_export"
+    path = hass.config.path(f"{prefix}_{dt_util.now():%Y%m%d_%H%M%S}.{file_format}")
+    writer = await hass.async_add_executor_job(WRITERS[file_format], path)
+    total = 0
+    try:
+        for contrato in contratos:
+            batches = contrato.async_history(date_from, date_to, fetch)
+            async for rows in async_iter_rows(contrato.contract, batches):
+                if rows:
+                    await hass.async_add_executor_job(writer.write, rows)
+                    total += len(rows)
+    finally:
+        await hass.async_add_executor_job(writer.close)
+
+    _LOGGER.warning(f"Exported {total} rows from {date_from} to {date_to} to {path}")
+    return path
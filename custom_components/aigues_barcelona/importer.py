@@ -0,0 +1,136 @@
+"""Chunked import of consumption statistics into the recorder."""
+
+import asyncio
+import logging
+from array import array
+
+import homeassistant.components.recorder.util as recorder_util
+from homeassistant.components.recorder.statistics import async_import_statistics
+from homeassistant.const import UnitOfVolume
+from homeassistant.core import HomeAssistant
+
+from .cache import ConsumptionCache
+from .const import DOMAIN
+from .const import IMPORT_CHUNK_SIZE
+from .series import ConsumptionSeries
+from .series import from_hour
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_IMPORT_LOCK = f"{DOMAIN}_import_lock"
+
+
+def get_db_instance(hass):
+    """Workaround for older HA versions."""
+    try:
+        return recorder_util.get_instance(hass)
+    except AttributeError:
+        return hass
+
+
+class StatisticsImporter:
+    """Collect statistics rows of a meter and write them to the recorder.
+
+    Rows can be added from any fetch path, duplicated hours are merged
+    (the last one wins). Pending rows are kept as a series and only
+    turned into recorder rows one chunk at a time. The recorder queue is
+    drained between chunks, so a big backfill does not fill the recorder
+    queue with a single job per window.
+
+    When ``written`` is given, it remembers the state sent for every
+    hour, and only new or changed hours are sent again.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        statistic_id: str,
+        chunk_size: int = IMPORT_CHUNK_SIZE,
+        written: ConsumptionCache = None,
+    ) -> None:
+        self.hass = hass
+        self.statistic_id = statistic_id
+        self.chunk_size = chunk_size
+        self.written = written
+        self.skipped = 0
+        self._series = ConsumptionSeries()
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    @property
+    def metadata(self) -> dict:
+        return {
+            "has_mean": False,
+            "has_sum": True,
+            "name": None,
+            "source": "recorder",  # required
+            "statistic_id": self.statistic_id,
+            "unit_of_measurement": UnitOfVolume.CUBIC_METERS,
+        }
+
+    def add(self, consumptions) -> None:
+        """Add API records or a ``ConsumptionSeries``."""
+        if not isinstance(consumptions, ConsumptionSeries):
+            consumptions = ConsumptionSeries.from_records(consumptions)
+        # round: fixes decimal with 20 digits precision
+        rounded = array("d", [round(value, 4) for value in consumptions.values])
+        self._series = self._series.merge(
+            ConsumptionSeries.from_arrays(consumptions.hours, rounded)
+        )
+
+    @staticmethod
+    def _rows(series: ConsumptionSeries, lo: int, hi: int) -> list[dict]:
+        rows = list()
+        for hour, state in zip(series.hours[lo:hi], series.values[lo:hi]):
+            rows.append(
+                {
+                    "start": from_hour(hour),  # required
+                    "state": state,
+                    # -- required to show in historic/recorder
+                    # -- incremental sum = current total value, so we don't show negative values in HA
+                    "sum": state,
+                    # "last_reset": start_ts,
+                }
+            )
+        return rows
+
+    async def async_flush(self) -> int:
+        """Write all pending rows, return how many were sent."""
+        series, self._series = self._series, ConsumptionSeries()
+        if series and self.written is not None:
+            await self.written.async_load(self.hass)
+            sent = self.written.series(
+                from_hour(series.first_hour), from_hour(series.last_hour + 1)
+            )
+            changed = series.changed(sent)
+            self.skipped += len(series) - len(changed)
+            if len(changed) < len(series):
+                _LOGGER.debug(
+                    f"Skipped {len(series) - len(changed)} unchanged rows "
+                    f"of {self.statistic_id}"
+                )
+            series = changed
+
+        total = len(series)
+        if not total:
+            return 0
+
+        # one importer at a time across all contracts
+        lock = self.hass.data.setdefault(DATA_IMPORT_LOCK, asyncio.Lock())
+        async with lock:
+            for pos in range(0, total, self.chunk_size):
+                chunk = self._rows(series, pos, pos + self.chunk_size)
+                async_import_statistics(self.hass, self.metadata, chunk)
+                await self._async_wait_recorder()
+        if self.written is not None:
+            await self.written.async_add(self.hass, series.records())
+
+        _LOGGER.debug(f"Imported {total} rows into {self.statistic_id}")
+        return total
+
+    async def _async_wait_recorder(self) -> None:
+        """Wait until the recorder has processed its queue."""
+        instance = get_db_instance(self.hass)
+        if hasattr(instance, "async_block_till_done"):
+            await instance.async_block_till_done()
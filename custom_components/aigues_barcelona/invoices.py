@@ -0,0 +1,141 @@
+"""Invoices of a contract, fetched in full once and then incrementally."""
+
+import logging
+from datetime import date
+from datetime import datetime
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .api import AsyncAiguesApiClient
+from .const import DOMAIN
+from .const import INVOICE_FULL_MONTHS
+from .const import INVOICE_RECENT_MONTHS
+from .const import STORAGE_VERSION
+
+_LOGGER = logging.getLogger(__name__)
+
+# the API field names are not documented, accept the known variants;
+# payloads matching none of them are logged with their keys
+FIELDS = {
+    "number": ("invoiceNumber", "invoiceId", "number"),
+    "amount": ("totalAmount", "amount", "invoiceAmount"),
+    "issued": ("issueDate", "invoiceDate", "date"),
+    "period_from": ("periodFrom", "consumptionPeriodFrom", "fromDate"),
+    "period_to": ("periodTo", "consumptionPeriodTo", "toDate"),
+}
+
+
+def _parse_date(value) -> str | None:
+    if not value:
+        return None
+    value = str(value)[:10]
+    for fmt in ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_invoice(data: dict) -> dict | None:
+    """Return the fields used by the sensors, None if not an invoice."""
+    if not isinstance(data, dict):
+        _LOGGER.warning(f"Unrecognised invoice payload: {type(data).__name__}")
+        return None
+    invoice = {
+        name: next((data[key] for key in keys if data.get(key) is not None), None)
+        for name, keys in FIELDS.items()
+    }
+    if invoice["number"] is None:
+        _LOGGER.warning(
+            f"Unrecognised invoice payload without a number, keys: {sorted(data)}"
+        )
+        return None
+    invoice["number"] = str(invoice["number"])
+    try:
+        invoice["amount"] = float(invoice["amount"])
+    except (TypeError, ValueError):
+        invoice["amount"] = None
+    for name in ("issued", "period_from", "period_to"):
+        invoice[name] = _parse_date(invoice[name])
+    return invoice
+
+
+class InvoiceStore:
+    """Invoices and outstanding debt of a contract, kept on disk.
+
+    The whole history is asked for once; afterwards only the last
+    months are, and merged by invoice number. The debt is small and
+    asked for on every update.
+    """
+
+    def __init__(
+        self, hass: HomeAssistant, api: AsyncAiguesApiClient, contract: str
+    ) -> None:
+        self.hass = hass
+        self.contract = contract
+        self._api = api
+        self._store = Store(
+            hass, STORAGE_VERSION, f"{DOMAIN}.{contract.lower()}.invoices"
+        )
+        self._loaded = False
+        self.invoices: dict[str, dict] = dict()
+        self.debt: list[dict] = list()
+        self.full_fetched: datetime | None = None
+
+    async def async_load(self) -> None:
+        if self._loaded:
+            return
+        stored = await self._store.async_load() or {}
+        self._loaded = True
+        self.invoices = stored.get("invoices", {})
+        self.debt = stored.get("debt", [])
+        if stored.get("full_fetched"):
+            self.full_fetched = datetime.fromisoformat(stored["full_fetched"])
+
+    async def async_update(self) -> int:
+        """Fetch new invoices and the debt, return how many were new."""
+        await self.async_load()
+        months = INVOICE_RECENT_MONTHS if self.full_fetched else INVOICE_FULL_MONTHS
+        data = await self._api.invoices(self.contract, last_months=months)
+        debt = await self._api.invoices_debt(self.contract)
+
+        new = 0
+        for invoice in filter(None, map(parse_invoice, data or [])):
+            if invoice["number"] not in self.invoices:
+                new += 1
+            self.invoices[invoice["number"]] = invoice
+        self.debt = list(filter(None, map(parse_invoice, debt or [])))
+        if self.full_fetched is None:
+            self.full_fetched = dt_util.utcnow()
+
+        _LOGGER.debug(
+            f"Got {new} new invoices of {self.contract} from the last {months} months"
+        )
+        await self._store.async_save(
+            {
+                "invoices": self.invoices,
+                "debt": self.debt,
+                "full_fetched": self.full_fetched.isoformat(),
+            }
+        )
+        return new
+
+    @property
+    def latest(self) -> dict | None:
+        """Return the last invoice issued."""
+        return max(
+            self.invoices.values(),
+            key=lambda x: (x["issued"] or "", x["number"]),
+            default=None,
+        )
+
+    @property
+    def debt_amount(self) -> float:
+        return round(sum(x["amount"] or 0.0 for x in self.debt), 2)
+
+    @staticmethod
+    def as_date(value: str | None) -> date | None:
+        return date.fromisoformat(value) if value else None
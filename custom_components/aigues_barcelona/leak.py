@@ -0,0 +1,141 @@
+"""Leak detection over the hourly consumption readings."""
+
+from collections import deque
+
+from homeassistant.util import dt as dt_util
+
+from .const import LEAK_CONTINUOUS_HOURS
+from .const import LEAK_MIN_FLOW
+from .const import LEAK_NIGHT_HOURS
+from .const import LEAK_NIGHT_THRESHOLD
+from .const import LEAK_SPIKE_FACTOR
+from .const import LEAK_SPIKE_MIN
+from .const import LEAK_WINDOW_HOURS
+from .series import ConsumptionSeries
+from .series import from_hour
+
+PROBLEM_CONTINUOUS_FLOW = "continuous_flow"
+PROBLEM_NIGHT_FLOW = "night_flow"
+PROBLEM_SPIKE = "spike"
+
+
+class LeakDetector:
+    """Look for leaks in the flow of each new hour.
+
+    The flow of the last ``LEAK_WINDOW_HOURS`` is kept in a ring buffer
+    with its running sum, so every hour is evaluated in O(1):
+
+    - continuous flow: water used in every hour for a full day
+    - night flow: the lowest flow of the night hours is above a
+      threshold, something is running while nobody should be using it
+    - spike: an hour uses several times the average of the window
+    """
+
+    def __init__(self) -> None:
+        self.window: deque[float] = deque(maxlen=LEAK_WINDOW_HOURS)
+        self.window_sum = 0.0
+        self.last_hour: int | None = None
+        self.last_value: float | None = None
+        # consecutive hours with flow
+        self.flowing_hours = 0
+        # lowest flow of the night being read and of the last full one
+        self.night_min: float | None = None
+        self.last_night_min: float | None = None
+        self.spike: float | None = None
+
+    @property
+    def problems(self) -> dict[str, bool]:
+        return {
+            PROBLEM_CONTINUOUS_FLOW: self.flowing_hours >= LEAK_CONTINUOUS_HOURS,
+            PROBLEM_NIGHT_FLOW: self.last_night_min is not None
+            and self.last_night_min > LEAK_NIGHT_THRESHOLD,
+            PROBLEM_SPIKE: self.spike is not None,
+        }
+
+    def _add_flow(self, hour: int, flow: float) -> float | None:
+        """Account the flow of an hour, return it if it is a spike."""
+        average = self.window_sum / len(self.window) if self.window else None
+        spike = None
+        if (
+            average is not None
+            and flow >= LEAK_SPIKE_MIN
+            and flow > average * LEAK_SPIKE_FACTOR
+        ):
+            spike = flow
+
+        if len(self.window) == self.window.maxlen:
+            self.window_sum -= self.window[0]
+        self.window.append(flow)
+        self.window_sum += flow
+
+        self.flowing_hours = self.flowing_hours + 1 if flow > LEAK_MIN_FLOW else 0
+
+        if dt_util.as_local(from_hour(hour)).hour in LEAK_NIGHT_HOURS:
+            self.night_min = (
+                flow if self.night_min is None else min(self.night_min, flow)
+            )
+        elif self.night_min is not None:
+            self.last_night_min, self.night_min = self.night_min, None
+        return spike
+
+    def update(self, series: ConsumptionSeries) -> list[str]:
+        """Evaluate the hours after the last one seen.
+
+        Return the problems that were not present before this batch. A
+        spike is reported for every batch with one, the biggest of the
+        batch is kept.
+        """
+        before = self.problems
+        if self.last_hour is not None:
+            series = series.after(self.last_hour)
+        if series:
+            self.spike = None
+            before[PROBLEM_SPIKE] = False
+
+            if self.last_hour is not None:
+                # the last reading seen gives the flow of the first hour
+                series = ConsumptionSeries([self.last_hour], [self.last_value]).merge(
+                    series
+                )
+
+            hours = series.hours
+            for pos, delta in enumerate(series.deltas(), 1):
+                # spread the consumption of missed hours evenly
+                gap = hours[pos] - hours[pos - 1]
+                flow = max(delta, 0.0) / gap
+                if gap > 1:
+                    self.flowing_hours = 0
+                spike = self._add_flow(hours[pos], flow)
+                if spike is not None and (self.spike is None or spike > self.spike):
+                    self.spike = spike
+            self.last_hour, self.last_value = hours[-1], series.values[-1]
+
+        return [
+            problem
+            for problem, active in self.problems.items()
+            if active and not before[problem]
+        ]
+
+    def as_dict(self) -> dict:
+        return {
+            "window": list(self.window),
+            "last_hour": self.last_hour,
+            "last_value": self.last_value,
+            "flowing_hours": self.flowing_hours,
+            "night_min": self.night_min,
+            "last_night_min": self.last_night_min,
+            "spike": self.spike,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LeakDetector":
+        detector = cls()
+        detector.window.extend(data.get("window", []))
+        detector.window_sum = sum(detector.window)
+        detector.last_hour = data.get("last_hour")
+        detector.last_value = data.get("last_value")
+        detector.flowing_hours = data.get("flowing_hours", 0)
+        detector.night_min = data.get("night_min")
+        detector.last_night_min = data.get("last_night_min")
+        detector.spike = data.get("spike")
+        return detector
@@ -0,0 +1,111 @@
+"""Request and update timings, collected only when enabled."""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# upper bound of each latency bucket, in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))
+
+
+class EndpointMetrics:
+    """Counters and latency histogram of a single endpoint."""
+
+    __slots__ = ("requests", "statuses", "bytes", "retries", "latency", "buckets")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.statuses: dict[str, int] = dict()
+        self.bytes = 0
+        self.retries = 0
+        # total seconds, to get the mean
+        self.latency = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "statuses": dict(self.statuses),
+            "bytes": self.bytes,
+            "retries": self.retries,
+            "latency_mean": (
+                round(self.latency / self.requests, 4) if self.requests else None
+            ),
+            "latency_histogram": {
+                f"le_{bound}": count
+                for bound, count in zip(LATENCY_BUCKETS, self.buckets)
+            },
+        }
+
+
+class RequestMetrics:
+    """Metrics of the requests of an API client, by endpoint path."""
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.endpoints: dict[str, EndpointMetrics] = dict()
+
+    def _endpoint(self, path: str) -> EndpointMetrics:
+        metrics = self.endpoints.get(path)
+        if metrics is None:
+            metrics = self.endpoints[path] = EndpointMetrics()
+        return metrics
+
+    def record(self, path: str, status, elapsed: float, size: int) -> None:
+        """Account a request answered with ``status``, or failed (None)."""
+        metrics = self._endpoint(path)
+        metrics.requests += 1
+        status = "error" if status is None else str(status)
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+        metrics.bytes += size
+        metrics.latency += elapsed
+        metrics.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def record_retry(self, path: str) -> None:
+        self._endpoint(path).retries += 1
+
+    @property
+    def requests(self) -> int:
+        return sum(x.requests for x in self.endpoints.values())
+
+    def as_dict(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "endpoints": {
+                path: metrics.as_dict() for path, metrics in self.endpoints.items()
+            },
+        }
+
+
+class PhaseTimings:
+    """Duration of the phases of the last update, and their totals."""
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.last: dict[str, float] = dict()
+        self.total: dict[str, float] = dict()
+        self.count: dict[str, int] = dict()
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.last[name] = elapsed
+            self.total[name] = self.total.get(name, 0.0) + elapsed
+            self.count[name] = self.count.get(name, 0) + 1
+
+    def as_dict(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "last": {name: round(value, 4) for name, value in self.last.items()},
+            "mean": {
+                name: round(self.total[name] / self.count[name], 4)
+                for name in self.total
+            },
+        }
@@ -0,0 +1,87 @@
+"""Profile an update or backfill and write a report to the config dir."""
+
+import cProfile
+import io
+import logging
+import pstats
+from typing import Awaitable
+
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+# where the time goes, matched in order against the function location
+CATEGORIES = {
+    # idle event loop: waiting for the API, or for the recorder thread
+    "waiting": ("select.epoll", "select.kqueue", "select.select"),
+    "network": ("aiohttp", "selectors", "socket", "ssl", "yarl"),
+    "json decode": ("orjson", "json/decoder", "json.loads", "fromisoformat"),
+    "sorting": ("sort", "bisect", "merge"),
+    "statistics": ("importer.py", "recorder/statistics", "_rows"),
+}
+
+TOP_FUNCTIONS = 40
+
+
+def categorize(stats: pstats.Stats) -> dict[str, float]:
+    """Split the time spent in each function (own time) by category."""
+    split = {name: 0.0 for name in CATEGORIES}
+    split["other"] = 0.0
+    for (filename, _, function), (_, _, tottime, _, _) in stats.stats.items():
+        location = f"{filename}:{function}"
+        for name, patterns in CATEGORIES.items():
+            if any(pattern in location for pattern in patterns):
+                split[name] += tottime
+                break
+        else:
+            split["other"] += tottime
+    return split
+
+
+def write_report(profile: cProfile.Profile, path: str, title: str, elapsed: float):
+    """Write the report of a finished profile. Blocking."""
+    out = io.StringIO()
+    stats = pstats.Stats(profile, stream=out)
+    split = categorize(stats)
+    total = sum(split.values()) or 1.0
+
+    with open(path, "w") as fp:
+        fp.write(f"{title}\n")
+        fp.write(f"Wall time: {elapsed:.3f}s, profiled time: {total:.3f}s\n\n")
+        fp.write("Time split by category (own time):\n")
+        for name, seconds in sorted(split.items(), key=lambda x: -x[1]):
+            fp.write(f"  {name:12} {seconds:8.3f}s {seconds / total:6.1%}\n")
+
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+        fp.write("\nTop functions by cumulative time:\n")
+        fp.write(out.getvalue())
+
+        out.seek(0)
+        out.truncate()
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP_FUNCTIONS)
+        fp.write("\nTop functions by own time:\n")
+        fp.write(out.getvalue())
+
+
+async def async_profile(hass: HomeAssistant, job: Awaitable, title: str) -> str:
+    """Await ``job`` under cProfile, return the path of the report.
+
+    The profiler sees everything run by the event loop meanwhile, not
+    only ``job``. Work done in other threads, like the recorder writing
+    the statistics, only shows up as time waiting for it.
+    """
+    path = hass.config.path(f"{DOMAIN}_profile_{dt_util.now():%Y%m%d_%H%M%S}.txt")
+    profile = cProfile.Profile()
+    started = dt_util.utcnow()
+    profile.enable()
+    try:
+        await job
+    finally:
+        profile.disable()
+        elapsed = (dt_util.utcnow() - started).total_seconds()
+        await hass.async_add_executor_job(write_report, profile, path, title, elapsed)
+    _LOGGER.warning(f"Profile of {title} written to {path}")
+    return path
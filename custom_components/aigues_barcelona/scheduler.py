@@ -0,0 +1,102 @@
+"""Adaptive polling based on when the API publishes new readings."""
+
+from collections import deque
+from datetime import datetime
+from datetime import timedelta
+from statistics import median
+
+from .const import DEFAULT_SCAN_PERIOD
+from .const import MAX_SCAN_PERIOD
+from .const import MIN_SCAN_PERIOD
+from .const import SCHEDULER_HISTORY
+from .const import SCHEDULER_MARGIN
+
+
+class PublicationModel:
+    """Learn the publication lag and cadence of a contract readings.
+
+    Every poll reports the datetime of the latest record received. When
+    it moves forward, two things are learnt: how long after its own
+    datetime the record became visible (lag), and how far the latest
+    record advanced since the previous publication (cadence). The next
+    publication is then expected at ``latest + cadence + lag``.
+
+    The record was published between the previous poll and this one, so
+    the lag is estimated as the middle of that interval. Polling close
+    to the expected time narrows it down on every publication.
+    """
+
+    def __init__(self) -> None:
+        self.latest: datetime | None = None
+        self.last_poll: datetime | None = None
+        self.lags: deque[float] = deque(maxlen=SCHEDULER_HISTORY)
+        self.cadences: deque[float] = deque(maxlen=SCHEDULER_HISTORY)
+        # polls without new data since the last publication
+        self.misses = 0
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.lags) and bool(self.cadences)
+
+    def observe(self, now: datetime, latest: datetime | None) -> bool:
+        """Account a poll result, return whether it brought new data."""
+        previous_poll, self.last_poll = self.last_poll, now
+        if latest is None or (self.latest is not None and latest <= self.latest):
+            self.misses += 1
+            return False
+
+        if self.latest is not None:
+            self.cadences.append((latest - self.latest).total_seconds())
+            published_after = max(previous_poll or latest, latest)
+            lag = (published_after - latest + now - latest).total_seconds() / 2
+            self.lags.append(max(0.0, lag))
+        self.latest = latest
+        self.misses = 0
+        return True
+
+    def expected_at(self) -> datetime | None:
+        """Return when the next publication is expected."""
+        if not self.ready:
+            return None
+        return self.latest + timedelta(
+            seconds=median(self.cadences) + median(self.lags)
+        )
+
+    def next_poll(self, now: datetime) -> timedelta:
+        """Return how long to wait before polling again."""
+        expected = self.expected_at()
+        if expected is None:
+            delay = timedelta(seconds=DEFAULT_SCAN_PERIOD)
+        elif expected + SCHEDULER_MARGIN > now:
+            # poll just after the data is likely to appear
+            delay = expected + SCHEDULER_MARGIN - now
+        else:
+            # late publication, back off exponentially
+            misses = min(max(self.misses - 1, 0), 8)
+            delay = timedelta(seconds=MIN_SCAN_PERIOD * 2**misses)
+
+        return min(
+            max(delay, timedelta(seconds=MIN_SCAN_PERIOD)),
+            timedelta(seconds=MAX_SCAN_PERIOD),
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "latest": self.latest.isoformat() if self.latest else None,
+            "last_poll": self.last_poll.isoformat() if self.last_poll else None,
+            "lags": list(self.lags),
+            "cadences": list(self.cadences),
+            "misses": self.misses,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PublicationModel":
+        model = cls()
+        if data.get("latest"):
+            model.latest = datetime.fromisoformat(data["latest"])
+        if data.get("last_poll"):
+            model.last_poll = datetime.fromisoformat(data["last_poll"])
+        model.lags.extend(data.get("lags", []))
+        model.cadences.extend(data.get("cadences", []))
+        model.misses = data.get("misses", 0)
+        return model
@@ -2,97 +2,65 @@
 
 # from __future__ import annotations
 import logging
-from datetime import datetime
-from datetime import timedelta
-
-import homeassistant.components.recorder.util as recorder_util
-
-try:
-    from homeassistant.components.recorder.const import (
-        DATA_INSTANCE as RECORDER_DATA_INSTANCE,
-    )
-except ImportError:  # NEW Home Assistant 2024.08
-    from homeassistant.helpers.recorder import (
-        DATA_INSTANCE as RECORDER_DATA_INSTANCE,
-    )
-from homeassistant.components.recorder.statistics import async_import_statistics
-from homeassistant.components.recorder.statistics import clear_statistics
-from homeassistant.components.recorder.statistics import list_statistic_ids
+
+from homeassistant.components.sensor import RestoreSensor
 from homeassistant.components.sensor import SensorDeviceClass
 from homeassistant.components.sensor import SensorEntity
 from homeassistant.components.sensor import SensorStateClass
-from homeassistant.const import CONF_PASSWORD
 from homeassistant.const import CONF_STATE
-from homeassistant.const import CONF_TOKEN
-from homeassistant.const import CONF_USERNAME
-from homeassistant.const import EVENT_HOMEASSISTANT_START
+from homeassistant.const import CURRENCY_EURO
+from homeassistant.const import EntityCategory
+from homeassistant.const import PERCENTAGE
+from homeassistant.const import UnitOfTime
 from homeassistant.const import UnitOfVolume
 from homeassistant.core import callback
-from homeassistant.core import CoreState
+from homeassistant.core import Event
 from homeassistant.core import HomeAssistant
-from homeassistant.exceptions import ConfigEntryAuthFailed
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
-from homeassistant.helpers.update_coordinator import TimestampDataUpdateCoordinator
+from homeassistant.util import dt as dt_util
 
-from .api import AiguesApiClient
-from .const import API_ERROR_TOKEN_REVOKED
 from .const import ATTR_LAST_MEASURE
 from .const import CONF_CONTRACT
 from .const import CONF_VALUE
-from .const import DEFAULT_SCAN_PERIOD
 from .const import DOMAIN
-from .const import CONF_COMPANY_IDENTIFICATOR  # Add this
-
-from typing import Optional
+from .const import EVENT_BACKFILL
+from .totals import PERIOD_DAY
+from .totals import PERIOD_HOUR
+from .totals import PERIOD_MONTH
+from .totals import PERIOD_WEEK
 
 _LOGGER = logging.getLogger(__name__)
 
-
-def get_db_instance(hass):
-    """Workaround for older HA versions."""
-    try:
-        return recorder_util.get_instance(hass)
-    except AttributeError:
-        return hass
+PERIOD_NAMES = {
+    PERIOD_HOUR: "Consumo ultima hora",
+    PERIOD_DAY: "Consumo hoy",
+    PERIOD_WEEK: "Consumo semana",
+    PERIOD_MONTH: "Consumo mes",
+}
 
 
 async def async_setup_entry(hass: HomeAssistant, config_entry, async_add_entities):
     """Set up entry."""
-    hass.data.setdefault(DOMAIN, {})
-
     _LOGGER.info("calling async_setup_entry")
 
-    username = config_entry.data[CONF_USERNAME]
-    password = config_entry.data[CONF_PASSWORD]
-    contracts = config_entry.data[CONF_CONTRACT]
-    token = config_entry.data.get(CONF_TOKEN)
-    company_identification = config_entry.data.get(CONF_COMPANY_IDENTIFICATOR)
+    coordinator = hass.data[DOMAIN][config_entry.entry_id]
 
     contadores = list()
 
-    for contract in contracts:
-        coordinator = ContratoAgua(
-            hass,
-            username,
-            password,
-            contract,
-            token=token,
-            company_identification=company_identification,
-        )
-        contadores.append(ContadorAgua(coordinator))
-
-    # postpone first refresh to speed up startup
-    @callback
-    async def async_first_refresh(*args):
-        for sensor in contadores:
-            await sensor.coordinator.async_refresh()
-
-    # ------
-
-    if hass.state == CoreState.running:
-        await async_first_refresh()
-    else:
-        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_START, async_first_refresh)
+    for contrato in coordinator.contracts.values():
+        contadores.append(ContadorAgua(coordinator, contrato))
+        for period in PERIOD_NAMES:
+            contadores.append(ConsumoPeriodo(coordinator, contrato, period))
+        store = coordinator.invoices.stores[contrato.contract]
+        contadores.append(ImporteFactura(coordinator.invoices, store))
+        contadores.append(PeriodoFactura(coordinator.invoices, store))
+        contadores.append(DeudaPendiente(coordinator.invoices, store))
+        contadores.append(ProgresoBackfill(coordinator, contrato))
+
+    if coordinator.timings.enabled:
+        contadores.append(PeticionesApi(coordinator, config_entry))
+        for contrato in coordinator.contracts.values():
+            contadores.append(DuracionActualizacion(coordinator, contrato))
 
     _LOGGER.info("about to add entities")
     async_add_entities(contadores)
@@ -100,237 +68,254 @@ async def async_setup_entry(hass: HomeAssistant, config_entry, async_add_entitie
     return True
 
 
-class ContratoAgua(TimestampDataUpdateCoordinator):
-    def __init__(
-        self,
-        hass: HomeAssistant,
-        username: str,
-        password: str,
-        contract: str,
-        token: str = None,
-        prev_data=None,
-        company_identification=None,
-    ) -> None:
-        """Initialize the data handler."""
-        self.reset = prev_data is None
-
-        self.contract = contract.upper()
-        self.id = contract.lower()
-        self.internal_sensor_id = f"sensor.contador_{self.id}"
-
-        if not hass.data[DOMAIN].get(self.contract):
-            # init data shared store
-            hass.data[DOMAIN][self.contract] = {}
-
-        # create alias
-        self._data = hass.data[DOMAIN][self.contract]
-
-        # WARN define a pointer to this object
-        hass.data[DOMAIN][self.contract]["coordinator"] = self
-
-        # the api object
-        self._api = AiguesApiClient(
-            username, password, contract, company_identification=company_identification
-        )
-        if token:
-            self._api.set_token(token)
-
-        super().__init__(
-            hass,
-            _LOGGER,
-            name=self.id,
-            update_interval=timedelta(seconds=DEFAULT_SCAN_PERIOD),
-        )
+class ContadorAgua(CoordinatorEntity, RestoreSensor):
+    """Representation of a sensor."""
+
+    def __init__(self, coordinator, contrato) -> None:
+        """Initialize the sensor."""
+        super().__init__(coordinator)
+        self.contrato = contrato
+        self._attr_name = f"Contador {contrato.id}"
+        self._attr_unique_id = contrato.id
+        self._attr_icon = "mdi:water-pump"
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self._attr_device_class = SensorDeviceClass.WATER
+        self._attr_state_class = SensorStateClass.TOTAL
+        self._attr_native_unit_of_measurement = UnitOfVolume.CUBIC_METERS
 
-    def __repr__(self):
-        return f"<{self.__class__.__name__} {self.contract}>"
-
-    async def _async_update_data(self):
-        _LOGGER.info(f"Updating coordinator data for {self.contract}")
-        TODAY = datetime.now()
-        LAST_WEEK = TODAY - timedelta(days=7)
-        LAST_TIME_DAYS = None
-
-        # last_measurement = await self.get_last_measurement_stored()
-        # _LOGGER.info("Last stored measurement: %s", last_measurement)
-
-        try:
-            previous = datetime.fromisoformat(self._data.get(CONF_STATE, ""))
-            # FIX: TypeError: can't subtract offset-naive and offset-aware datetimes
-            previous = previous.replace(tzinfo=None)
-            if previous:
-                LAST_TIME_DAYS = (TODAY - previous).days
-        except ValueError:
-            previous = None
-
-        if previous and (TODAY - previous) <= timedelta(minutes=60):
-            _LOGGER.warning("Skipping request update data - too early")
+    async def async_added_to_hass(self) -> None:
+        """Show the last known value until the first refresh is done."""
+        await super().async_added_to_hass()
+        if CONF_VALUE in self.contrato._data:
             return
 
-        consumptions = None
-        try:
-            if self._api.is_token_expired():
-                raise ConfigEntryAuthFailed
-            # TODO: change once recaptcha is fiexd
-            # await self.hass.async_add_executor_job(self._api.login)
-            consumptions = await self.hass.async_add_executor_job(
-                self._api.consumptions, LAST_WEEK, TODAY, self.contract
-            )
-        except ConfigEntryAuthFailed as exp:
-            _LOGGER.error("Token has expired, cannot check consumptions.")
-            raise ConfigEntryAuthFailed from exp
-        except Exception as exp:
-            self.async_set_update_error(exp)
-            if API_ERROR_TOKEN_REVOKED in str(exp):
-                raise ConfigEntryAuthFailed from exp
-
-        if not consumptions:
-            _LOGGER.error("No consumptions available")
-            return False
-
-        self._data["consumptions"] = consumptions
-
-        # get last entry - most updated
-        metric = consumptions[-1]
-        self._data[CONF_VALUE] = metric["accumulatedConsumption"]
-        self._data[CONF_STATE] = metric["datetime"]
-
-        # await self._clear_statistics()
-        try:
-            await self._async_import_statistics(consumptions)
-        except:
-            pass
-
-        if LAST_TIME_DAYS and LAST_TIME_DAYS >= 7:
-            await self.import_old_consumptions(days=LAST_TIME_DAYS)
-
-        return True
-
-    async def _clear_statistics(self) -> None:
-        all_ids = await get_db_instance(self.hass).async_add_executor_job(
-            list_statistic_ids, self.hass
-        )
-        to_clear = [
-            x["statistic_id"]
-            for x in all_ids
-            if x["statistic_id"].startswith(self.internal_sensor_id)
-        ]
-
-        if to_clear:
-            _LOGGER.warn(
-                f"About to delete {len(to_clear)} entries from {self.contract}"
-            )
-            # NOTE: This does not seem to work?
-            await get_db_instance(self.hass).async_add_executor_job(
-                clear_statistics, self.hass.data[RECORDER_DATA_INSTANCE], to_clear
-            )
-
-    async def get_last_measurement_stored(self) -> Optional[datetime]:
-        last_stored = None
-
-        all_ids = await get_db_instance(self.hass).async_add_executor_job(
-            list_statistic_ids, self.hass
-        )
+        last_data = await self.async_get_last_sensor_data()
+        if last_data is None or last_data.native_value is None:
+            return
+        self.contrato._data[CONF_VALUE] = last_data.native_value
 
-        for stat_id in all_ids:
-            if stat_id["statistic_id"] == self.internal_sensor_id:
-                if stat_id.get("sum") and stat_id["sum"] > last_stored["sum"]:
-                    last_stored = stat_id
+        last_state = await self.async_get_last_state()
+        last_measure = last_state.attributes.get(ATTR_LAST_MEASURE)
+        if isinstance(last_measure, str):
+            last_measure = dt_util.parse_datetime(last_measure)
+        self.contrato._data.setdefault(CONF_STATE, last_measure)
 
-        if last_stored:
-            _LOGGER.debug(f"Found last stored value: {last_stored}")
-            return datetime.fromtimestamp(last_stored.get("start_ts"))
+    @property
+    def native_value(self):
+        return self.contrato._data.get(CONF_VALUE, None)
 
-        return None
+    @property
+    def last_measurement(self):
+        return self.contrato._data.get(CONF_STATE)
 
-    async def _async_import_statistics(self, consumptions) -> None:
-        # force sort by datetime
-        consumptions = sorted(
-            consumptions, key=lambda x: datetime.fromisoformat(x["datetime"])
-        )
+    @property
+    def extra_state_attributes(self):
+        attrs = {ATTR_LAST_MEASURE: self.last_measurement}
+        return attrs
+
+
+class ConsumoPeriodo(CoordinatorEntity, SensorEntity):
+    """Consumption of the current hour, day, week or month."""
+
+    def __init__(self, coordinator, contrato, period: str) -> None:
+        super().__init__(coordinator)
+        self.contrato = contrato
+        self.period = period
+        self._attr_name = f"{PERIOD_NAMES[period]} {contrato.id}"
+        self._attr_unique_id = f"{contrato.id}_{period}"
+        self._attr_icon = "mdi:water"
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self._attr_device_class = SensorDeviceClass.WATER
+        self._attr_state_class = SensorStateClass.TOTAL
+        self._attr_native_unit_of_measurement = UnitOfVolume.CUBIC_METERS
+
+    @property
+    def native_value(self):
+        return self.contrato.totals.total(self.period)
+
+    @property
+    def last_reset(self):
+        return self.contrato.totals.start(self.period)
+
+
+class PeticionesApi(CoordinatorEntity, SensorEntity):
+    """Requests sent to the API by an account, only with metrics enabled."""
+
+    def __init__(self, coordinator, config_entry) -> None:
+        super().__init__(coordinator)
+        self._attr_name = f"Peticiones API {config_entry.title}"
+        self._attr_unique_id = f"{config_entry.entry_id}_api_requests"
+        self._attr_icon = "mdi:api"
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+
+    @property
+    def native_value(self):
+        return self.coordinator.api.metrics.requests
 
-        stats = list()
-        for metric in consumptions:
-            start_ts = datetime.fromisoformat(metric["datetime"])
-            start_ts = start_ts.replace(minute=0, second=0, microsecond=0)  # required
-
-            # round: fixes decimal with 20 digits precision
-            state = round(metric["accumulatedConsumption"], 4)
-            stats.append(
-                {
-                    "start": start_ts,
-                    "state": state,
-                    # -- required to show in historic/recorder
-                    # -- incremental sum = current total value, so we don't show negative values in HA
-                    "sum": state,
-                    # "last_reset": start_ts,
-                }
-            )
-        metadata = {
-            "has_mean": False,
-            "has_sum": True,
-            "name": None,
-            "source": "recorder",  # required
-            "statistic_id": self.internal_sensor_id,
-            "unit_of_measurement": UnitOfVolume.CUBIC_METERS,
+    @property
+    def extra_state_attributes(self):
+        return {
+            path: {
+                "requests": metrics.requests,
+                "retries": metrics.retries,
+                "latency_mean": metrics.as_dict()["latency_mean"],
+            }
+            for path, metrics in self.coordinator.api.metrics.endpoints.items()
         }
-        # _LOGGER.debug(f"Adding metric: {metadata} {stats}")
-        async_import_statistics(self.hass, metadata, stats)
 
-    async def clear_all_stored_data(self) -> None:
-        await self._clear_statistics()
 
-    async def import_old_consumptions(self, days: int = 365) -> None:
-        today = datetime.now()
-        one_year_ago = today - timedelta(days=days)
+class DuracionActualizacion(CoordinatorEntity, SensorEntity):
+    """Duration of the last update of a contract, by phase."""
 
-        if self._api.is_token_expired():
-            raise ConfigEntryAuthFailed
+    def __init__(self, coordinator, contrato) -> None:
+        super().__init__(coordinator)
+        self.contrato = contrato
+        self._attr_name = f"Duracion actualizacion {contrato.id}"
+        self._attr_unique_id = f"{contrato.id}_update_duration"
+        self._attr_icon = "mdi:timer-outline"
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self._attr_device_class = SensorDeviceClass.DURATION
+        self._attr_native_unit_of_measurement = UnitOfTime.SECONDS
+        self._attr_suggested_display_precision = 2
 
-        current_date = one_year_ago
-        while current_date < today:
-            consumptions = await self.hass.async_add_executor_job(
-                self._api.consumptions_week, current_date, self.contract
-            )
+    @property
+    def native_value(self):
+        last = self.contrato.timings.last
+        return round(sum(last.values()), 3) if last else None
 
-            if consumptions:
-                await self._async_import_statistics(consumptions)
-            else:
-                _LOGGER.warning(f"No data available for {current_date}")
+    @property
+    def extra_state_attributes(self):
+        return self.contrato.timings.as_dict()["last"]
 
-            current_date += timedelta(weeks=1)
 
+class ProgresoBackfill(CoordinatorEntity, SensorEntity):
+    """Progress of the last backfill of a contract."""
 
-class ContadorAgua(CoordinatorEntity, SensorEntity):
-    """Representation of a sensor."""
+    def __init__(self, coordinator, contrato) -> None:
+        super().__init__(coordinator)
+        self.contrato = contrato
+        self._attr_name = f"Progreso historico {contrato.id}"
+        self._attr_unique_id = f"{contrato.id}_backfill_progress"
+        self._attr_icon = "mdi:progress-download"
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self._attr_native_unit_of_measurement = PERCENTAGE
 
-    def __init__(self, coordinator) -> None:
-        """Initialize the sensor."""
+    async def async_added_to_hass(self) -> None:
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            self.hass.bus.async_listen(EVENT_BACKFILL, self._async_progress)
+        )
+
+    @callback
+    def _async_progress(self, event: Event) -> None:
+        if event.data.get(CONF_CONTRACT) == self.contrato.contract:
+            self.async_write_ha_state()
+
+    @property
+    def native_value(self):
+        return self.contrato.backfill.percent
+
+    @property
+    def extra_state_attributes(self):
+        progress = self.contrato.backfill
+        return {
+            "date_from": progress.date_from,
+            "date_to": progress.date_to,
+            "windows_done": progress.windows_done,
+            "windows_total": progress.windows_total,
+            "rows": progress.rows,
+            "eta": progress.eta,
+            "finished": progress.finished,
+        }
+
+
+class InvoiceSensor(CoordinatorEntity, SensorEntity):
+    """Base of the sensors fed by the invoice store of a contract."""
+
+    _name = ""
+    _key = ""
+
+    def __init__(self, coordinator, store) -> None:
         super().__init__(coordinator)
-        self._attr_name = f"Contador {coordinator.id}"
-        self._attr_unique_id = coordinator.id
-        self._attr_icon = "mdi:water-pump"
+        self.store = store
+        self._attr_name = f"{self._name} {store.contract.lower()}"
+        self._attr_unique_id = f"{store.contract.lower()}_{self._key}"
         self._attr_has_entity_name = True
         self._attr_should_poll = False
-        self._attr_device_class = SensorDeviceClass.WATER
-        self._attr_state_class = SensorStateClass.TOTAL
-        self._attr_native_unit_of_measurement = UnitOfVolume.CUBIC_METERS
+
+    @property
+    def available(self) -> bool:
+        # the stored invoices are valid even if the last update failed
+        return self.native_value is not None
+
+    @property
+    def extra_state_attributes(self):
+        latest = self.store.latest
+        if latest is None:
+            return None
+        return {
+            "invoice": latest["number"],
+            "issued": latest["issued"],
+            "period_from": latest["period_from"],
+            "period_to": latest["period_to"],
+        }
+
+
+class ImporteFactura(InvoiceSensor):
+    """Amount of the last invoice."""
+
+    _name = "Importe ultima factura"
+    _key = "invoice_amount"
+    _attr_icon = "mdi:receipt-text"
+    _attr_device_class = SensorDeviceClass.MONETARY
+    _attr_native_unit_of_measurement = CURRENCY_EURO
 
     @property
     def native_value(self):
-        return self.coordinator._data.get(CONF_VALUE, None)
+        latest = self.store.latest
+        return latest["amount"] if latest else None
+
+
+class PeriodoFactura(InvoiceSensor):
+    """Last day billed by the last invoice."""
+
+    _name = "Periodo ultima factura"
+    _key = "invoice_period"
+    _attr_icon = "mdi:calendar-range"
+    _attr_device_class = SensorDeviceClass.DATE
 
     @property
-    def last_measurement(self):
-        try:
-            last_measure = datetime.fromisoformat(
-                self.coordinator._data.get(CONF_STATE, "")
-            )
-        except ValueError:
-            last_measure = None
-        return last_measure
+    def native_value(self):
+        latest = self.store.latest
+        if latest is None:
+            return None
+        return self.store.as_date(latest["period_to"] or latest["issued"])
+
+
+class DeudaPendiente(InvoiceSensor):
+    """Amount of the invoices not paid yet."""
+
+    _name = "Deuda pendiente"
+    _key = "debt"
+    _attr_icon = "mdi:cash-clock"
+    _attr_device_class = SensorDeviceClass.MONETARY
+    _attr_native_unit_of_measurement = CURRENCY_EURO
+
+    @property
+    def native_value(self):
+        if self.store.full_fetched is None:
+            return None
+        return self.store.debt_amount
 
     @property
     def extra_state_attributes(self):
-        attrs = {ATTR_LAST_MEASURE: self.last_measurement}
-        return attrs
+        return {"invoices": [x["number"] for x in self.store.debt]}
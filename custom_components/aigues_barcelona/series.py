@@ -0,0 +1,153 @@
+"""Compact in-memory representation of consumption readings."""
+
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from datetime import timezone
+from operator import sub
+from typing import Iterable
+from typing import Iterator
+
+from .api import ConsumptionRecord
+
+
+def to_hour(when: datetime) -> int:
+    """Return the hours since epoch of the hour containing ``when``."""
+    return int(when.timestamp()) // 3600
+
+
+def from_hour(hour: int) -> datetime:
+    return datetime.fromtimestamp(hour * 3600, tz=timezone.utc)
+
+
+class ConsumptionSeries:
+    """Accumulated readings by hour, kept in two parallel sorted arrays.
+
+    Hours are stored as hours since epoch (``int64``) and readings as
+    ``float64``, so a year of hourly data takes about 140 kB. When
+    ``max_size`` is set, only the most recent hours are kept.
+    """
+
+    __slots__ = ("hours", "values", "max_size")
+
+    def __init__(
+        self,
+        hours: Iterable[int] = (),
+        values: Iterable[float] = (),
+        max_size: int = None,
+    ) -> None:
+        self.hours = array("q", hours)
+        self.values = array("d", values)
+        self.max_size = max_size
+        self._trim()
+
+    @classmethod
+    def from_records(
+        cls, records: Iterable[ConsumptionRecord], max_size: int = None
+    ) -> "ConsumptionSeries":
+        """Build a series from API records, in any order.
+
+        When several records fall in the same hour, the last one wins.
+        """
+        by_hour = {to_hour(x.datetime): x.accumulated_consumption for x in records}
+        hours = sorted(by_hour)
+        return cls(hours, [by_hour[hour] for hour in hours], max_size)
+
+    @classmethod
+    def from_arrays(
+        cls, hours: array, values: array, max_size: int = None
+    ) -> "ConsumptionSeries":
+        """Wrap sorted, unique arrays without copying them."""
+        series = cls(max_size=max_size)
+        series.hours, series.values = hours, values
+        series._trim()
+        return series
+
+    def __len__(self) -> int:
+        return len(self.hours)
+
+    def __bool__(self) -> bool:
+        return bool(self.hours)
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {len(self)} hours>"
+
+    @property
+    def first_hour(self) -> int | None:
+        return self.hours[0] if self.hours else None
+
+    @property
+    def last_hour(self) -> int | None:
+        return self.hours[-1] if self.hours else None
+
+    def _trim(self) -> None:
+        if self.max_size is not None and len(self.hours) > self.max_size:
+            del self.hours[: len(self.hours) - self.max_size]
+            del self.values[: len(self.values) - self.max_size]
+
+    def merge(self, other: "ConsumptionSeries") -> "ConsumptionSeries":
+        """Return both series merged; ``other`` wins on the same hour."""
+        hours = array("q")
+        values = array("d")
+        a_hours, a_values = self.hours, self.values
+        b_hours, b_values = other.hours, other.values
+        i = j = 0
+        while i < len(a_hours) and j < len(b_hours):
+            if a_hours[i] < b_hours[j]:
+                hours.append(a_hours[i])
+                values.append(a_values[i])
+                i += 1
+            else:
+                if a_hours[i] == b_hours[j]:
+                    i += 1
+                hours.append(b_hours[j])
+                values.append(b_values[j])
+                j += 1
+        hours.extend(a_hours[i:])
+        values.extend(a_values[i:])
+        hours.extend(b_hours[j:])
+        values.extend(b_values[j:])
+
+        return ConsumptionSeries.from_arrays(hours, values, self.max_size)
+
+    def changed(self, other: "ConsumptionSeries") -> "ConsumptionSeries":
+        """Return the hours missing from ``other`` or with another value."""
+        hours = array("q")
+        values = array("d")
+        b_hours, b_values = other.hours, other.values
+        j = 0
+        for hour, value in zip(self.hours, self.values):
+            while j < len(b_hours) and b_hours[j] < hour:
+                j += 1
+            if j < len(b_hours) and b_hours[j] == hour and b_values[j] == value:
+                continue
+            hours.append(hour)
+            values.append(value)
+        return ConsumptionSeries.from_arrays(hours, values, self.max_size)
+
+    def slice(
+        self, start_hour: int = None, end_hour: int = None
+    ) -> "ConsumptionSeries":
+        """Return the hours in ``[start_hour, end_hour)``."""
+        lo = 0 if start_hour is None else bisect_left(self.hours, start_hour)
+        hi = len(self.hours) if end_hour is None else bisect_left(self.hours, end_hour)
+        return ConsumptionSeries.from_arrays(
+            self.hours[lo:hi], self.values[lo:hi], self.max_size
+        )
+
+    def after(self, hour: int) -> "ConsumptionSeries":
+        """Return the hours strictly after ``hour``."""
+        return self.slice(hour + 1)
+
+    def deltas(self) -> array:
+        """Return the consumption between consecutive readings.
+
+        The first reading has no previous one, so the result is one item
+        shorter than the series.
+        """
+        values = self.values
+        return array("d", map(sub, values[1:], values[:-1]))
+
+    def records(self) -> Iterator[ConsumptionRecord]:
+        for hour, value in zip(self.hours, self.values):
+            yield ConsumptionRecord(from_hour(hour), value)
@@ -1,32 +1,174 @@
 import logging
+from datetime import datetime
+from datetime import timedelta
+
+from .const import CONF_CONTRACT
 from .const import DOMAIN
+from .export import async_export
+from .export import WRITERS
+from .profiler import async_profile
 
+import voluptuous as vol
 from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.typing import ConfigType
+from homeassistant.util import slugify
 
 _LOGGER = logging.getLogger(__name__)
 
 
 async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     async def handle_reset_and_refresh_data(call: ServiceCall) -> None:
-        contract = next(iter(hass.data[DOMAIN]), None)
-        if not contract:
+        contracts = {contract.upper() for contract in call.data.get(CONF_CONTRACT, [])}
+        date_to = call.data.get("date_to") or datetime.now().date()
+        date_from = call.data.get("date_from") or date_to - timedelta(days=365)
+        if date_from > date_to:
+            _LOGGER.error(f"Backfill range is empty: {date_from} > {date_to}")
+            return
+
+        # account coordinators, stored by config entry id
+        accounts = [
+            v for v in hass.data.get(DOMAIN, {}).values() if hasattr(v, "contracts")
+        ]
+        started = list()
+        for account in accounts:
+            for contract, contrato in account.contracts.items():
+                if contracts and contract not in contracts:
+                    continue
+                # TODO: Not working - Detected unsafe call not in recorder thread
+                # await clear_stored_data(hass, contrato)
+                _LOGGER.warning(f"Backfilling {contract} from {date_from} to {date_to}")
+                account.entry.async_create_background_task(
+                    hass,
+                    contrato.async_run_backfill(
+                        date_from, date_to, force=call.data["force"]
+                    ),
+                    f"{DOMAIN} backfill {contract}",
+                )
+                started.append(contract)
+
+        if not started:
+            _LOGGER.error("No contracts available")
+        elif contracts - set(started):
+            _LOGGER.error(f"Contracts not found: {', '.join(contracts - set(started))}")
+
+    hass.services.async_register(
+        DOMAIN,
+        "reset_and_refresh_data",
+        handle_reset_and_refresh_data,
+        schema=vol.Schema(
+            {
+                vol.Optional(CONF_CONTRACT): vol.All(cv.ensure_list, [cv.string]),
+                vol.Optional("date_from"): cv.date,
+                vol.Optional("date_to"): cv.date,
+                vol.Optional("force", default=True): cv.boolean,
+            }
+        ),
+    )
+
+    async def handle_export(call: ServiceCall) -> None:
+        contracts = {contract.upper() for contract in call.data.get(CONF_CONTRACT, [])}
+        date_to = call.data.get("date_to") or datetime.now().date()
+        date_from = call.data.get("date_from") or date_to - timedelta(days=365)
+
+        # an export per account, cancelled when its entry is unloaded
+        exports = list()
+        for account in hass.data.get(DOMAIN, {}).values():
+            if not hasattr(account, "contracts"):
+                continue
+            contratos = [
+                contrato
+                for contract, contrato in account.contracts.items()
+                if not contracts or contract in contracts
+            ]
+            if contratos:
+                exports.append((account.entry, contratos))
+        if not exports:
             _LOGGER.error("No contracts available")
             return
 
-        coordinator = hass.data[DOMAIN].get(contract).get("coordinator")
-        if not coordinator:
-            _LOGGER.error(f"Contract coordinator for {contract} not found")
+        async def async_run_export(entry, contratos):
+            try:
+                await async_export(
+                    hass,
+                    contratos,
+                    date_from,
+                    date_to,
+                    call.data["format"],
+                    call.data["fetch"],
+                    name=slugify(entry.title),
+                )
+            except Exception as exp:
+                _LOGGER.error(f"Export of {entry.title} failed: {exp}")
+
+        for entry, contratos in exports:
+            entry.async_create_background_task(
+                hass,
+                async_run_export(entry, contratos),
+                f"{DOMAIN} export {entry.title}",
+            )
+
+    hass.services.async_register(
+        DOMAIN,
+        "export",
+        handle_export,
+        schema=vol.Schema(
+            {
+                vol.Optional(CONF_CONTRACT): vol.All(cv.ensure_list, [cv.string]),
+                vol.Optional("date_from"): cv.date,
+                vol.Optional("date_to"): cv.date,
+                vol.Optional("format", default="csv"): vol.In(list(WRITERS)),
+                vol.Optional("fetch", default=True): cv.boolean,
+            }
+        ),
+    )
+
+    async def handle_profile(call: ServiceCall) -> None:
+        contract = call.data.get(CONF_CONTRACT)
+        accounts = [
+            v for v in hass.data.get(DOMAIN, {}).values() if hasattr(v, "contracts")
+        ]
+        if not accounts:
+            _LOGGER.error("No accounts available to profile")
+            return
+        account = next(
+            (
+                v
+                for v in accounts
+                if contract is None or contract.upper() in v.contracts
+            ),
+            None,
+        )
+        if not account:
+            _LOGGER.error(f"No account found for contract {contract}")
             return
 
-        _LOGGER.warning(f"Performing reset and refresh for {contract}")
+        if call.data["target"] == "backfill":
+            contrato = account.contracts.get(
+                (contract or next(iter(account.contracts))).upper()
+            )
+            days = call.data["days"]
+            job = contrato.import_old_consumptions(days=days)
+            title = f"Backfill of {days} days for {contrato.contract}"
+        else:
+            job = account.async_refresh()
+            title = f"Update of {account.name}"
 
-        # TODO: Not working - Detected unsafe call not in recorder thread
-        # await clear_stored_data(hass, coordinator)
-        await fetch_historic_data(hass, coordinator)
+        await async_profile(hass, job, title)
 
     hass.services.async_register(
-        DOMAIN, "reset_and_refresh_data", handle_reset_and_refresh_data
+        DOMAIN,
+        "profile",
+        handle_profile,
+        schema=vol.Schema(
+            {
+                vol.Optional(CONF_CONTRACT): cv.string,
+                vol.Optional("target", default="update"): vol.In(
+                    ["update", "backfill"]
+                ),
+                vol.Optional("days", default=365): cv.positive_int,
+            }
+        ),
     )
     return True
 
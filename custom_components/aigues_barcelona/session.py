@@ -0,0 +1,81 @@
+"""HTTP sessions of the API clients of the integration."""
+
+import logging
+
+import aiohttp
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_PASSWORD
+from homeassistant.const import CONF_USERNAME
+from homeassistant.core import callback
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_create_clientsession
+
+from .api import AsyncAiguesApiClient
+from .api import TIMEOUT
+from .const import CONF_COMPANY_IDENTIFICATOR
+from .const import CONF_CONNECTION_LIMIT
+from .const import CONF_CONNECTION_LIMIT_PER_HOST
+from .const import DEFAULT_CONNECTION_LIMIT
+from .const import DEFAULT_CONNECTION_LIMIT_PER_HOST
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@callback
+def async_create_session(hass: HomeAssistant):
+    """Create a session on the connection pool of Home Assistant.
+
+    Cookies are not kept, each client sends its own token. Sessions
+    created while a config entry is set up are released when it is
+    unloaded.
+    """
+    return async_create_clientsession(
+        hass,
+        cookie_jar=aiohttp.DummyCookieJar(),
+        timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+    )
+
+
+@callback
+def async_create_client(
+    hass: HomeAssistant,
+    username: str,
+    password: str,
+    contract: str = None,
+    company_identification: str = None,
+    options: dict = None,
+) -> AsyncAiguesApiClient:
+    """Create an async API client on the Home Assistant connection pool.
+
+    The API is a single host, so the lowest of the connection limits in
+    the options bounds the requests in flight. They are read again when
+    the entry is reloaded.
+    """
+    options = options or {}
+    limit = min(
+        options.get(CONF_CONNECTION_LIMIT, DEFAULT_CONNECTION_LIMIT),
+        options.get(CONF_CONNECTION_LIMIT_PER_HOST, DEFAULT_CONNECTION_LIMIT_PER_HOST),
+    )
+    return AsyncAiguesApiClient(
+        username,
+        password,
+        contract,
+        session=async_create_session(hass),
+        company_identification=company_identification,
+        limit=limit,
+    )
+
+
+@callback
+def async_create_entry_client(
+    hass: HomeAssistant, entry: ConfigEntry, contract: str = None
+) -> AsyncAiguesApiClient:
+    """Create an async API client from the config entry credentials."""
+    return async_create_client(
+        hass,
+        entry.data[CONF_USERNAME],
+        entry.data[CONF_PASSWORD],
+        contract,
+        company_identification=entry.data.get(CONF_COMPANY_IDENTIFICATOR),
+        options=entry.options,
+    )
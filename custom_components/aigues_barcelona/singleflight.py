@@ -0,0 +1,111 @@
+"""Run the long jobs of a contract one at a time."""
+
+import asyncio
+import logging
+from datetime import date
+from datetime import timedelta
+from typing import Awaitable
+from typing import Callable
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RangeSingleFlight:
+    """Run a job over ranges of days, never two at the same time.
+
+    A request for days covered by the running job waits for it instead
+    of starting another one. Other requests are queued, and queued
+    ranges that overlap or touch are merged, so a day is not processed
+    twice. All the callers of a range get its result, or its error.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        job: Callable[[date, date], Awaitable],
+        create_task: Callable,
+    ) -> None:
+        self.name = name
+        self._job = job
+        # hass or config entry background task factory, (coro, name)
+        self._create_task = create_task
+        # [start, end, futures], both ends included
+        self._running: list | None = None
+        self._queue: list[list] = list()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> tuple[date, date] | None:
+        return tuple(self._running[:2]) if self._running else None
+
+    @property
+    def pending(self) -> list[tuple[date, date]]:
+        return [(start, end) for start, end, _ in self._queue]
+
+    async def async_run(self, start: date, end: date) -> None:
+        """Run the job for ``[start, end]``, or join the one in flight."""
+        loop = asyncio.get_running_loop()
+        futures = list()
+        pieces = [(start, end)]
+
+        if self._running:
+            running_start, running_end = self._running[:2]
+            if running_start <= end and start <= running_end:
+                future = loop.create_future()
+                self._running[2].append(future)
+                futures.append(future)
+                # only the days outside the running range are left
+                pieces = list()
+                if start < running_start:
+                    pieces.append((start, running_start - timedelta(days=1)))
+                if end > running_end:
+                    pieces.append((running_end + timedelta(days=1), end))
+
+        for piece_start, piece_end in pieces:
+            future = loop.create_future()
+            self._queue.append([piece_start, piece_end, [future]])
+            futures.append(future)
+        if pieces:
+            self._merge_queue()
+            if self._task is None:
+                self._task = self._create_task(self._async_worker(), self.name)
+        else:
+            _LOGGER.debug(f"{self.name}: joining the running job")
+
+        # a cancelled caller does not cancel the job of the others
+        await asyncio.shield(asyncio.gather(*futures))
+
+    def _merge_queue(self) -> None:
+        merged = list()
+        for item in sorted(self._queue, key=lambda x: x[0]):
+            if merged and item[0] <= merged[-1][1] + timedelta(days=1):
+                merged[-1][1] = max(merged[-1][1], item[1])
+                merged[-1][2] += item[2]
+            else:
+                merged.append(item)
+        self._queue = merged
+
+    async def _async_worker(self) -> None:
+        try:
+            while self._queue:
+                self._running = self._queue.pop(0)
+                start, end, futures = self._running
+                try:
+                    await self._job(start, end)
+                except Exception as exp:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(exp)
+                else:
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(None)
+                self._running = None
+        finally:
+            # cancelled, the config entry is being unloaded
+            for _, _, futures in filter(None, [self._running, *self._queue]):
+                for future in futures:
+                    future.cancel()
+            self._running = None
+            self._queue = list()
+            self._task = None
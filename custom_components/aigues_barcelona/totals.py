@@ -0,0 +1,112 @@
+"""Running consumption totals by calendar period."""
+
+from datetime import datetime
+from datetime import timedelta
+
+from homeassistant.util import dt as dt_util
+
+from .series import ConsumptionSeries
+from .series import from_hour
+from .series import to_hour
+
+PERIOD_HOUR = "hour"
+PERIOD_DAY = "day"
+PERIOD_WEEK = "week"
+PERIOD_MONTH = "month"
+
+PERIODS = (PERIOD_HOUR, PERIOD_DAY, PERIOD_WEEK, PERIOD_MONTH)
+
+
+def period_start(period: str, hour: int) -> datetime:
+    """Return the local start of the period containing an epoch hour."""
+    start = dt_util.as_local(from_hour(hour))
+    if period == PERIOD_HOUR:
+        return start
+    start = start.replace(hour=0)
+    if period == PERIOD_WEEK:
+        start -= timedelta(days=start.weekday())
+    elif period == PERIOD_MONTH:
+        start = start.replace(day=1)
+    return start
+
+
+class ConsumptionTotals:
+    """Consumption of the current hour, day, week and month.
+
+    Only the last reading and the reading before each period started are
+    kept, so adding a sample is O(1) and history is never read again.
+    Readings must be added in order; older or repeated hours are
+    ignored. A period is only complete, and has a total, when a reading
+    from before it started was seen.
+    """
+
+    __slots__ = ("last_hour", "last_value", "starts", "baselines", "complete")
+
+    def __init__(self) -> None:
+        self.last_hour: int | None = None
+        self.last_value: float | None = None
+        # epoch hour where each period starts
+        self.starts: dict[str, int] = dict()
+        # accumulated reading before each period started
+        self.baselines: dict[str, float] = dict()
+        # periods whose baseline is a reading from before they started
+        self.complete: set[str] = set()
+
+    def add(self, hour: int, value: float) -> bool:
+        """Account a new reading, return whether it was used."""
+        if self.last_hour is not None and hour <= self.last_hour:
+            return False
+
+        for period in PERIODS:
+            start = to_hour(period_start(period, hour))
+            if self.starts.get(period) != start:
+                self.starts[period] = start
+                if self.last_value is None:
+                    # the first reading ever, part of the period is missing
+                    self.baselines[period] = value
+                    self.complete.discard(period)
+                else:
+                    self.baselines[period] = self.last_value
+                    self.complete.add(period)
+        self.last_hour, self.last_value = hour, value
+        return True
+
+    def add_series(self, series: ConsumptionSeries) -> int:
+        """Account the readings after the last one, return how many."""
+        if self.last_hour is not None:
+            series = series.after(self.last_hour)
+        for hour, value in zip(series.hours, series.values):
+            self.add(hour, value)
+        return len(series)
+
+    def total(self, period: str) -> float | None:
+        if self.last_value is None or period not in self.complete:
+            return None
+        return round(self.last_value - self.baselines[period], 4)
+
+    def start(self, period: str) -> datetime | None:
+        if period not in self.starts:
+            return None
+        return dt_util.as_local(from_hour(self.starts[period]))
+
+    def as_dict(self) -> dict:
+        return {
+            "last_hour": self.last_hour,
+            "last_value": self.last_value,
+            "starts": self.starts,
+            "baselines": self.baselines,
+            "complete": sorted(self.complete),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ConsumptionTotals":
+        totals = cls()
+        if "complete" not in data:
+            # saved by an older version, baselines may be partial
+            return totals
+        totals.last_hour = data.get("last_hour")
+        totals.last_value = data.get("last_value")
+        totals.starts.update(data.get("starts", {}))
+        totals.baselines.update(data.get("baselines", {}))
+        totals.complete.update(data["complete"])
+        return totals